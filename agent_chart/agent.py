@@ -48,8 +48,9 @@ async def  after_tool_call(
     parsed_json = json.loads(text_content)
   
     chart_base64 = parsed_json.get("chart_base64", "")
-    if not chart_base64:
-        print("[Callback] Không tìm thấy chart_base64 trong tool_response")
+    chart_uri = parsed_json.get("chart_uri", "")
+    if not chart_base64 and not chart_uri:
+        print("[Callback] Không tìm thấy chart_base64/chart_uri trong tool_response")
         return None   # không có ảnh thì trả nguyên
     modified_response = deepcopy(parsed_json)
     tool_context.actions.skip_summarization=True
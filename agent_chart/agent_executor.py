@@ -172,6 +172,22 @@ def convert_genai_parts_to_a2a(parts: list[types.Part]) -> list[Part]:
 
 def convert_genai_part_to_a2a(part: types.Part) -> Part:
     """Convert a single Google Gen AI Part type into an A2A Part type."""
+    if part.function_response and part.function_response.response and part.function_response.response.get("chart_uri"):
+        # Ảnh đã nằm trong blob store dùng chung: chỉ gửi tham chiếu, không gửi bytes
+        return Part(
+            root=FilePart(
+                file = FileWithUri(
+                    uri=part.function_response.response.get("chart_uri"),
+                    mimeType="image/png",
+                    name=part.function_response.response.get("artifact_filename","image.png")
+                ),
+                metadata={
+                    "data":part.function_response.response.get("summary",""),
+                    "filepath":part.function_response.response.get("filepath",""),
+                    "message":part.function_response.response.get("message","Gửi file thành công"),
+                }
+            )
+        )
     if part.function_response and part.function_response.response and part.function_response.response.get("chart_base64"):
         return Part(
             root=FilePart(
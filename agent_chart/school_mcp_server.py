@@ -29,6 +29,7 @@ import sys
 
 import matplotlib.pyplot as plt
 import io, base64
+import hashlib
 load_dotenv()
 from constants import (
     GENERATED_THUMBNAILS_DIR,
@@ -134,6 +135,30 @@ async def make_api_request(
 #             logger.warning(f"Local file save failed (path: {save_dir}): {e}", exc_info=False)
 #     else:
 #         logger.debug("Local image saving skipped (SAVE_IMAGES_LOCALLY is False).")
+# Blob store dùng chung với host (thư mục IMAGE_DIR của host, mount chung).
+# Khi được cấu hình, ảnh biểu đồ được ghi một lần vào đây và chỉ gửi tham chiếu blob:// thay vì base64.
+BLOB_DIR = os.getenv("BLOB_DIR", "")
+BLOB_URI_PREFIX = "blob://"
+
+
+def _publish_chart(image_bytes: bytes) -> tuple[Optional[str], Optional[str]]:
+    """Returns (chart_base64, chart_uri): the blob URI when BLOB_DIR is set, otherwise base64."""
+    if not BLOB_DIR:
+        return base64.b64encode(image_bytes).decode("utf-8"), None
+    name = f"{hashlib.sha256(image_bytes).hexdigest()}.png"
+    path = os.path.join(BLOB_DIR, name)
+    try:
+        if not os.path.exists(path):
+            os.makedirs(BLOB_DIR, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(image_bytes)
+            os.replace(tmp_path, path)
+        return None, BLOB_URI_PREFIX + name
+    except OSError as e:
+        logger.warning(f"Không ghi được ảnh vào blob store ({BLOB_DIR}), gửi base64: {e}")
+        return base64.b64encode(image_bytes).decode("utf-8"), None
+
 # --- MCP Server Setup ---
 logging.info("Tạo MCP Server cho hệ thống quản lý trường học...")
 mcp = FastMCP("school-management-mcp-server")
@@ -261,7 +286,7 @@ async def get_student_gpa_by_semester(token: str, semester: Optional[str] = None
     buf.seek(0)
     image_bytes = buf.getvalue()
 
-    img_base64 = base64.b64encode(image_bytes).decode("utf-8")
+    img_base64, chart_uri = _publish_chart(image_bytes)
 
     # Lưu local
     with open(filepath, "wb") as f:
@@ -271,6 +296,7 @@ async def get_student_gpa_by_semester(token: str, semester: Optional[str] = None
         "success": True,
         "message": "Biểu đồ GPA học kỳ.",
         "chart_base64": img_base64,
+        "chart_uri": chart_uri,
         "filepath": filepath,
         "artifact_filename": filename,
         "artifact_version": None,
@@ -371,7 +397,7 @@ async def get_student_course_progress(token: str) -> Dict:
     buf.seek(0)
     image_bytes = buf.getvalue()
 
-    img_base64 = base64.b64encode(image_bytes).decode("utf-8")
+    img_base64, chart_uri = _publish_chart(image_bytes)
 
     with open(filepath, "wb") as f:
         f.write(image_bytes)
@@ -380,6 +406,7 @@ async def get_student_course_progress(token: str) -> Dict:
         "success": True,
         "message": "Biểu đồ tiến độ học tập.",
         "chart_base64": img_base64,
+        "chart_uri": chart_uri,
         "filepath": filepath,
         "artifact_filename": filename,
         "artifact_version": None,
@@ -467,7 +494,7 @@ async def get_teacher_class_enrollment_statistics(token: str, semester: Optional
         plt.close(fig)
         buf.seek(0)
         image_bytes = buf.getvalue()
-        img_base64 = base64.b64encode(image_bytes).decode("utf-8")
+        img_base64, chart_uri = _publish_chart(image_bytes)
 
         with open(filepath, "wb") as f:
             f.write(image_bytes)
@@ -476,6 +503,7 @@ async def get_teacher_class_enrollment_statistics(token: str, semester: Optional
             "success": True,
             "message": f"Biểu đồ sức chứa lớp {info['course_code']}",
             "chart_base64": img_base64,
+            "chart_uri": chart_uri,
             "filepath": filepath,
             "artifact_filename": filename,
             "artifact_version": None,
@@ -532,7 +560,7 @@ async def get_teacher_class_enrollment_statistics(token: str, semester: Optional
         plt.close(fig)
         buf.seek(0)
         image_bytes = buf.getvalue()
-        img_base64 = base64.b64encode(image_bytes).decode("utf-8")
+        img_base64, chart_uri = _publish_chart(image_bytes)
 
         with open(filepath, "wb") as f:
             f.write(image_bytes)
@@ -541,6 +569,7 @@ async def get_teacher_class_enrollment_statistics(token: str, semester: Optional
             "success": True,
             "message": "Biểu đồ tuyển sinh nhiều lớp.",
             "chart_base64": img_base64,
+            "chart_uri": chart_uri,
             "filepath": filepath,
             "artifact_filename": filename,
             "artifact_version": None,
@@ -685,12 +714,13 @@ async def get_teacher_student_grades_analysis(token: str, class_id: Optional[int
         buf.seek(0)
         image_bytes = buf.getvalue()
 
-        img_base64 = base64.b64encode(image_bytes).decode("utf-8")
+        img_base64, chart_uri = _publish_chart(image_bytes)
 
         response = {
             "success": True,
             "message": f"Biểu đồ phân tích điểm cho lớp {class_info.get('course_code','')}",
             "chart_base64": img_base64,
+            "chart_uri": chart_uri,
             "filepath": filepath,
             "artifact_filename": filename,
             "artifact_version": None,
@@ -736,13 +766,14 @@ async def get_teacher_student_grades_analysis(token: str, class_id: Optional[int
             plt.close(fig)
             buf.seek(0)
             image_bytes = buf.getvalue()
-            img_base64 = base64.b64encode(image_bytes).decode("utf-8")
+            img_base64, chart_uri = _publish_chart(image_bytes)
             with open(filepath, "wb") as f:
                 f.write(image_bytes)
             return {
                 "success": True,
                 "message": "Boxplot phân bố điểm cho các lớp (dữ liệu thô).",
                 "chart_base64": img_base64,
+                "chart_uri": chart_uri,
                 "filepath": filepath,
                 "artifact_filename": filename,
                 "artifact_version": None,
@@ -809,7 +840,7 @@ async def get_teacher_student_grades_analysis(token: str, class_id: Optional[int
         plt.close(fig)
         buf.seek(0)
         image_bytes = buf.getvalue()
-        img_base64 = base64.b64encode(image_bytes).decode("utf-8")
+        img_base64, chart_uri = _publish_chart(image_bytes)
 
         # Save local
         with open(filepath, "wb") as f:
@@ -819,6 +850,7 @@ async def get_teacher_student_grades_analysis(token: str, class_id: Optional[int
             "success": True,
             "message": "Biểu đồ phân tích điểm cho nhiều lớp.",
             "chart_base64": img_base64,
+            "chart_uri": chart_uri,
             "filepath": filepath,
             "artifact_filename": filename,
             "artifact_version": None,
@@ -1055,7 +1087,7 @@ async def get_manager_department_personnel_statistics( token: str, department_id
     plt.close("all")
     buf.seek(0)
     image_bytes = buf.getvalue()
-    img_base64 = base64.b64encode(image_bytes).decode("utf-8")
+    img_base64, chart_uri = _publish_chart(image_bytes)
 
     # Lưu file local
     os.makedirs(GENERATED_THUMBNAILS_DIR, exist_ok=True)
@@ -1067,6 +1099,7 @@ async def get_manager_department_personnel_statistics( token: str, department_id
         "success": True,
         "message": "Biểu đồ nhân sự các khoa",
         "chart_base64": img_base64,
+        "chart_uri": chart_uri,
         "filepath": filepath,
         "artifact_filename": filename,
         "artifact_version": None,
@@ -1301,7 +1334,7 @@ async def get_manager_class_offering_statistics(token: str, department_id: Optio
     plt.close("all")
     buf.seek(0)
     image_bytes = buf.getvalue()
-    img_base64 = base64.b64encode(image_bytes).decode("utf-8")
+    img_base64, chart_uri = _publish_chart(image_bytes)
 
     # Lưu file local
     os.makedirs(GENERATED_THUMBNAILS_DIR, exist_ok=True)
@@ -1313,6 +1346,7 @@ async def get_manager_class_offering_statistics(token: str, department_id: Optio
         "success": True,
         "message": "Biểu đồ thống kê lớp học theo khoa",
         "chart_base64": img_base64,
+        "chart_uri": chart_uri,
         "filepath": filepath,
         "artifact_filename": filename,
         "artifact_version": None,
@@ -1509,7 +1543,7 @@ async def get_manager_comprehensive_system_report(token: str, semester: Optional
     image_bytes = buf.getvalue()
 
     # Encode base64 for safe JSON transport
-    img_base64 = base64.b64encode(image_bytes).decode("utf-8")
+    img_base64, chart_uri = _publish_chart(image_bytes)
 
     # Save local copy
     os.makedirs(GENERATED_THUMBNAILS_DIR, exist_ok=True)
@@ -1521,6 +1555,7 @@ async def get_manager_comprehensive_system_report(token: str, semester: Optional
         "success": True,
         "message": "Báo cáo tổng quan hệ thống (kèm biểu đồ)",
         "chart_base64": img_base64,
+        "chart_uri": chart_uri,
         "filepath": filepath,
         "artifact_filename": filename,
         "artifact_version": None,   # sẽ được callback cập nhật khi lưu artifact
@@ -0,0 +1,70 @@
+"""
+Benchmark: unpacking A2A task artifacts in the host.
+
+Compares the old path (model_dump_json -> json.loads -> walk dicts) with the
+typed extractor in host/artifacts.py on a task carrying a base64 chart PNG.
+
+    uv run python benchmarks/bench_artifact_extract.py
+"""
+import base64
+import json
+import os
+import sys
+import timeit
+
+from a2a.types import Artifact, FilePart, FileWithBytes, Part, Task, TaskState, TaskStatus, TextPart
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "host"))
+from artifacts import extract_parts  # noqa: E402
+
+IMAGE_SIZES = [64 * 1024, 512 * 1024, 2 * 1024 * 1024]
+ROUNDS = 50
+
+
+def build_task(image_size: int) -> Task:
+    image = base64.b64encode(os.urandom(image_size)).decode("utf-8")
+    return Task(
+        id="task",
+        contextId="context",
+        status=TaskStatus(state=TaskState.completed),
+        artifacts=[
+            Artifact(
+                artifactId="artifact",
+                parts=[
+                    Part(root=TextPart(text="Báo cáo thống kê lớp học")),
+                    Part(
+                        root=FilePart(
+                            file=FileWithBytes(bytes=image, mimeType="image/png", name="chart.png"),
+                            metadata={"data": "summary"},
+                        )
+                    ),
+                ],
+            )
+        ],
+    )
+
+
+def json_round_trip(task: Task) -> list[dict]:
+    json_content = json.loads(task.model_dump_json(exclude_none=True))
+    resp = []
+    for artifact in json_content.get("artifacts") or []:
+        if artifact.get("parts"):
+            resp.extend(artifact["parts"])
+    return resp
+
+
+def typed(task: Task) -> list[dict]:
+    return extract_parts(task.artifacts)
+
+
+def main():
+    print(f"{'image':>10} {'json round trip':>18} {'typed extractor':>18} {'speedup':>9}")
+    for size in IMAGE_SIZES:
+        task = build_task(size)
+        old = timeit.timeit(lambda: json_round_trip(task), number=ROUNDS) / ROUNDS
+        new = timeit.timeit(lambda: typed(task), number=ROUNDS) / ROUNDS
+        print(f"{size // 1024:>8}KB {old * 1000:>15.3f} ms {new * 1000:>15.3f} ms {old / new:>8.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark: database writes per host message.
+
+Replays the events of a typical turn (user message carrying the token delta,
+a send_message function call, its response and the final answer) against a
+SQLite BoundedSessionService, once with ADK's write-per-event path and once
+with SESSION_COALESCE_WRITES, and counts transactions and write statements.
+
+    uv run python benchmarks/bench_session_writes.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import types as pytypes
+
+from google.adk.events import Event, EventActions
+from google.genai import types
+from sqlalchemy import event as sa_event
+
+# Nạp host.sessions mà không chạy host/__init__.py (khởi tạo FastAPI app và gọi backend)
+HOST_DIR = os.path.join(os.path.dirname(__file__), "..", "host")
+host_package = pytypes.ModuleType("host")
+host_package.__path__ = [HOST_DIR]
+sys.modules["host"] = host_package
+from host import sessions  # noqa: E402
+
+APP_NAME = "Host_Agent"
+USER_ID = "user"
+TURNS = 50
+TOKEN = "x" * 400
+
+
+def turn_events(turn: int) -> list[Event]:
+    invocation_id = f"inv-{turn}"
+    return [
+        Event(
+            invocation_id=invocation_id,
+            author="user",
+            content=types.Content(role="user", parts=[types.Part(text=f"Câu hỏi {turn}")]),
+            actions=EventActions(state_delta={"token": TOKEN}),
+        ),
+        Event(
+            invocation_id=invocation_id,
+            author=APP_NAME,
+            content=types.Content(role="model", parts=[types.Part(function_call=types.FunctionCall(
+                name="send_message", args={"agent_name": "RagSchoolInfo", "task": f"Câu hỏi {turn}"},
+            ))]),
+        ),
+        Event(
+            invocation_id=invocation_id,
+            author=APP_NAME,
+            content=types.Content(role="user", parts=[types.Part(function_response=types.FunctionResponse(
+                name="send_message", response={"result": [{"kind": "text", "text": "..."}]},
+            ))]),
+        ),
+        Event(
+            invocation_id=invocation_id,
+            author=APP_NAME,
+            content=types.Content(role="model", parts=[types.Part(text=f"Trả lời {turn}")]),
+        ),
+    ]
+
+
+async def run(coalesce: bool) -> dict[str, float]:
+    sessions.SESSION_COALESCE_WRITES = coalesce
+    with tempfile.TemporaryDirectory() as tmp:
+        service = sessions.BoundedSessionService(db_url=f"sqlite:///{os.path.join(tmp, 'sessions.db')}")
+        created = await service.create_session(app_name=APP_NAME, user_id=USER_ID, state={"lang": "VN"})
+
+        counts = {"commits": 0, "statements": 0}
+
+        @sa_event.listens_for(service.db_engine, "commit")
+        def _on_commit(conn):
+            counts["commits"] += 1
+
+        @sa_event.listens_for(service.db_engine, "before_cursor_execute")
+        def _on_execute(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith(("INSERT", "UPDATE", "DELETE")):
+                counts["statements"] += 1
+
+        started = time.perf_counter()
+        for turn in range(TURNS):
+            session = await service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=created.id)
+            for event in turn_events(turn):
+                await service.append_event(session, event)
+            await service.flush(APP_NAME, USER_ID, created.id)
+        elapsed = time.perf_counter() - started
+        service.db_engine.dispose()
+
+    return {
+        "commits": counts["commits"] / TURNS,
+        "statements": counts["statements"] / TURNS,
+        "ms": elapsed / TURNS * 1000,
+    }
+
+
+async def main():
+    print(f"{TURNS} turns, 4 events per turn, SQLite")
+    print(f"{'mode':<12}{'commits/msg':>14}{'writes/msg':>14}{'ms/msg':>10}")
+    for name, coalesce in (("per-event", False), ("coalesced", True)):
+        result = await run(coalesce)
+        print(f"{name:<12}{result['commits']:>14.1f}{result['statements']:>14.1f}{result['ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
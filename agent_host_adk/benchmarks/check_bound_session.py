@@ -0,0 +1,91 @@
+"""
+Check: a session bound to a WebSocket sees turns written by other requests.
+
+Binds a session (as /ws/chat does), commits a full turn on the same session
+through a separately loaded copy (a second tab or /api/message), then checks
+that the bound get_session returns the new events, with coalesced writes on
+and off.
+
+    uv run python benchmarks/check_bound_session.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import types as pytypes
+
+from google.adk.events import Event
+from google.genai import types
+
+# Nạp host.sessions mà không chạy host/__init__.py (khởi tạo FastAPI app và gọi backend)
+HOST_DIR = os.path.join(os.path.dirname(__file__), "..", "host")
+host_package = pytypes.ModuleType("host")
+host_package.__path__ = [HOST_DIR]
+sys.modules["host"] = host_package
+from host import sessions  # noqa: E402
+
+APP_NAME = "Host_Agent"
+USER_ID = "user"
+
+
+def turn_events(turn: int) -> list[Event]:
+    invocation_id = f"inv-{turn}"
+    return [
+        Event(
+            invocation_id=invocation_id,
+            author="user",
+            content=types.Content(role="user", parts=[types.Part(text=f"q{turn}")]),
+        ),
+        Event(
+            invocation_id=invocation_id,
+            author=APP_NAME,
+            content=types.Content(role="model", parts=[types.Part(text=f"ans q{turn}")]),
+        ),
+    ]
+
+
+def texts(session) -> list[str]:
+    return [event.content.parts[0].text for event in session.events]
+
+
+async def run(coalesce: bool) -> list[str]:
+    sessions.SESSION_COALESCE_WRITES = coalesce
+    with tempfile.TemporaryDirectory() as tmp:
+        service = sessions.BoundedSessionService(db_url=f"sqlite:///{os.path.join(tmp, 'sessions.db')}")
+        created = await service.create_session(app_name=APP_NAME, user_id=USER_ID, state={})
+        key = dict(app_name=APP_NAME, user_id=USER_ID, session_id=created.id)
+
+        # Lượt đầu qua socket, với session được giữ sẵn
+        bound = await service.get_session(**key)
+        token = sessions.bound_session.set(bound)
+        session = await service.get_session(**key)
+        for event in turn_events(0):
+            await service.append_event(session, event)
+        await service.flush(**key)
+
+        # Request khác trên cùng session (không có session giữ sẵn) ghi một lượt đầy đủ
+        sessions.bound_session.reset(token)
+        other = await service.get_session(**key)
+        for event in turn_events(1):
+            await service.append_event(other, event)
+        await service.flush(**key)
+
+        sessions.bound_session.set(bound)
+        seen = texts(await service.get_session(**key))
+        service.db_engine.dispose()
+    return seen
+
+
+async def main():
+    expected = ["q0", "ans q0", "q1", "ans q1"]
+    failed = False
+    for name, coalesce in (("per-event", False), ("coalesced", True)):
+        seen = await run(coalesce)
+        ok = seen == expected
+        failed |= not ok
+        print(f"{name:<12}{'ok' if ok else 'STALE'}  {seen}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
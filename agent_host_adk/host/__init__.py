@@ -1,22 +1,31 @@
-from fastapi import FastAPI, HTTPException,Request
+from fastapi import FastAPI, HTTPException,Request, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
-from .agent import HostAgent, session_service
+from .agent import HostAgent, session_service, response_cache, remote_flight
 import uuid
 from google.genai import types
 import asyncio  
 import nest_asyncio  
 from datetime import datetime
-from .util import call_agent_async,check_token
+from .util import call_agent_async,agent_flight
+from .auth import Claims, TokenError, claims_cache, verify_token
 from contextlib import asynccontextmanager
 from  .call_api import get_agent_urls,get_available_agents,get_user_info
+from .transport import close_http_client
 import os
 from dotenv import load_dotenv
-from fastapi.responses import FileResponse
-import jwt
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+import json
+import math
+import mimetypes
+import re
+from .admission import AdmissionError, admission
+from .scheduler import DEFAULT_FLOW, llm_scheduler
+from .sessions import bound_session
+from .image_store import image_store
+from .tasks import TaskQueueFullError, task_manager, webhook_allowed
 load_dotenv()
 AGENT_NAME = "Host_Agent"
-IMAGE_DIR = os.getenv("IMAGE_DIR","http://localhost:9000/image/")
 friend_agent_urls = get_agent_urls()
 # friend_agent_urls = [
 #     # "http://192.168.1.163:3636"
@@ -26,6 +35,16 @@ friend_agent_urls = get_agent_urls()
 #     # "http://192.168.1.136:3636"
 #     # "https://ai-agent.bitech.vn/rag"
 # ]
+# Giới hạn cho /api/message/batch
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+# Chỉ các user_type này được chạy batch (công cụ dành cho cán bộ)
+BATCH_ALLOWED_USER_TYPES = {
+    user_type.strip()
+    for user_type in os.getenv("BATCH_ALLOWED_USER_TYPES", "Cán bộ quản lý,Giáo viên").split(",")
+    if user_type.strip()
+}
 print("initializing host agent")
 host = None
 
@@ -35,12 +54,18 @@ async def lifespan(app: FastAPI):
     global host, agents
     print("Initializing host agent...")
     host = await HostAgent.create(remote_agent_addresses=friend_agent_urls,name=AGENT_NAME)
+    task_manager.start()
+    session_service.start()
     print("HostAgent initialized successfully")
     
     yield
     # Shutdown
     print("Shutting down host agent...")
-    # Add cleanup code here if needed
+    await task_manager.stop()
+    await session_service.stop()
+    await host.close()
+    await image_store.evict()
+    await close_http_client()
 
 
 
@@ -98,14 +123,54 @@ class SendMessageResponse(BaseModel):
     response: dict[str, Any] 
     session_id: str
 
+class SubmitMessageRequest(SendMessageRequest):
+    webhook_url: Optional[str] = None
+
+class SubmitTaskResponse(BaseModel):
+    success: bool
+    task_id: str
+    status_url: str
+    session_id: str
+
+class TaskStatusResponse(BaseModel):
+    success: bool
+    task_id: str
+    status: str
+    response: Optional[dict[str, Any]] = None
+    error: Optional[str] = None
+
+class BatchMessageItem(BaseModel):
+    session_id: str
+    message: str
+    id: Optional[str] = None
+
+class BatchMessageRequest(BaseModel):
+    items: list[BatchMessageItem]
+    concurrency: Optional[int] = None
+
 class HealthResponse(BaseModel):
     status: str
     agent_name: str
+    agents: Optional[Dict[str, Any]] = None
+    caches: Optional[Dict[str, Any]] = None
+    tasks: Optional[Dict[str, Any]] = None
+    sessions: Optional[Dict[str, Any]] = None
+    admission: Optional[Dict[str, Any]] = None
+    schedulers: Optional[Dict[str, Any]] = None
 
 class ErrorResponse(BaseModel):
     success: bool
     error: str
 
+@app.exception_handler(AdmissionError)
+async def admission_error_handler(request: Request, exc: AdmissionError):
+    """429 khi user vượt token bucket, 503 khi host quá tải; luôn kèm Retry-After"""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
 @app.post("/api/session", response_model=CreateSessionResponse)
 async def create_session(request: CreateSessionRequest,raw_request: Request):
     """API để tạo session mới"""
@@ -123,15 +188,16 @@ async def create_session(request: CreateSessionRequest,raw_request: Request):
                 status_code=401,
                 detail="Authorization token is missing"
             )
-        user_info = get_user_info(token)
-        user_id = user_info.get("user_id")
+        user_info, agent_use = await asyncio.gather(
+            get_user_info(token), get_available_agents(token)
+        )
+        user_id = user_info.get("user_id") if user_info else None
         if not user_id or not user_info:
             raise HTTPException(
                 status_code=400,
                 detail="user_id and user_info are required"
             )
             
-        agent_use = get_available_agents(token)
         if not agent_use:
             raise HTTPException(
                 status_code=400,
@@ -162,23 +228,48 @@ async def create_session(request: CreateSessionRequest,raw_request: Request):
             detail=f"Failed to create session: {str(e)}"
         )
 
-@app.post("/api/message", response_model=SendMessageResponse)
-async def send_message(request: SendMessageRequest,raw_request: Request):
-    """API để gửi tin nhắn cho agent"""
-    headers = raw_request.headers
-    token = headers.get("Authorization", "").replace("Bearer ", "")
-    if check := check_token(token):
+def authenticate(raw_request: Request) -> Claims:
+    """Verifies the bearer token once per request and returns its claims."""
+    token = raw_request.headers.get("Authorization", "").replace("Bearer ", "")
+    try:
+        return verify_token(token)
+    except TokenError as e:
         raise HTTPException(
             status_code=401,
-            detail=check
+            detail=str(e)
         )
+
+async def user_flow(claims: Claims) -> str:
+    """Scheduling flow (user_type) of the caller: from the token if present, else from the cached user info."""
+    user_type = claims.payload.get("user_type")
+    if not user_type:
+        user_info = await get_user_info(claims.token)
+        user_type = user_info.get("user_type") if user_info else None
+    return user_type or DEFAULT_FLOW
+
+async def answer_message(claims: Claims, session_id: str, message: str, shed: bool = True):
+    """Answers one message: local fast path first, then the host LLM.
+
+    Runs inside a host admission slot; with shed=True it raises OverloadedError
+    instead of queueing behind a full host.
+    """
+    async with admission.slot(await user_flow(claims), shed=shed):
+        response = await host.try_fast_path(claims, session_id, message)
+        if response is None:
+            response = await call_agent_async(host.runner, claims, session_id, message)
+    return response
+
+@app.post("/api/message", response_model=SendMessageResponse)
+async def send_message(request: SendMessageRequest,raw_request: Request):
+    """API để gửi tin nhắn cho agent"""
+    claims = authenticate(raw_request)
     try:
         if not request.message:
             raise HTTPException(
                 status_code=400,
                 detail="Message is required"
             )
-        user_id = jwt.decode(token, options={"verify_signature": False}).get("sub")
+        user_id = claims.sub
         session_id = request.session_id 
         if not session_id:
             raise HTTPException(
@@ -190,9 +281,10 @@ async def send_message(request: SendMessageRequest,raw_request: Request):
                 status_code=400,
                 detail="user_id is error in token, please login again"
             )
+        admission.check_rate(user_id)
         # Gửi tin nhắn cho agent và nhận phản hồi
         # response = await root_agent.process_message(request.message, session_id=session_id)
-        response = await call_agent_async(host.runner, user_id, session_id, request.message, token)
+        response = await answer_message(claims, session_id, request.message)
         if not response:
             return SendMessageResponse(
                 success=False,
@@ -205,6 +297,8 @@ async def send_message(request: SendMessageRequest,raw_request: Request):
             session_id=session_id
         )
         
+    except AdmissionError:
+        raise
     except Exception as e:
         return SendMessageResponse(
             success=True,
@@ -212,54 +306,273 @@ async def send_message(request: SendMessageRequest,raw_request: Request):
             session_id=session_id
         )
 
-@app.post("/api/message_stream", response_model=SendMessageResponse)
-async def send_message(request: SendMessageRequest,raw_request: Request):
-    """API để gửi tin nhắn cho agent"""
-    headers = raw_request.headers
-    token = headers.get("Authorization", "").replace("Bearer ", "")
-    try:
-        if not request.message:
-            raise HTTPException(
-                status_code=400,
-                detail="Message is required"
-            )
-        
-        session_id = request.session_id 
-        
-        # Gửi tin nhắn cho agent và nhận phản hồi
-        # response = await root_agent.process_message(request.message, session_id=session_id)
-        response = await call_agent_async(host.runner, request.user_id, session_id, request.message, token)
-        if response.get("artifacts"):
-            for art in response["artifacts"]:
-                if "file_path" in art:
-                    print("Saved at:", art["file_path"])
-                    # Đọc file và return cho client (Flask/FastAPI: FileResponse, Django: FileResponse)
-                elif "file_uri" in art:
-                    print("File available at URI:", art["file_uri"])
+@app.post("/api/message/async", status_code=202, response_model=SubmitTaskResponse)
+async def submit_message(request: SubmitMessageRequest,raw_request: Request):
+    """API gửi tin nhắn chạy nền: trả task_id ngay, client poll /api/task/{task_id} hoặc nhận webhook"""
+    claims = authenticate(raw_request)
+    if not request.message:
+        raise HTTPException(
+            status_code=400,
+            detail="Message is required"
+        )
+    user_id = claims.sub
+    session_id = request.session_id
+    if not session_id:
+        raise HTTPException(
+            status_code=400,
+            detail="session_id is required"
+        )
+    if not user_id:
+        raise HTTPException(
+            status_code=400,
+            detail="user_id is error in token, please login again"
+        )
+
+    admission.check_rate(user_id)
+
+    if request.webhook_url and not await webhook_allowed(request.webhook_url):
+        raise HTTPException(
+            status_code=400,
+            detail="webhook_url is not allowed"
+        )
 
+    async def job():
+        # TaskManager đã giới hạn hàng đợi, task nền chờ đến lượt thay vì bị từ chối
+        response = await answer_message(claims, session_id, request.message, shed=False)
         if not response:
-            return "Lỗi hệ thống. vui lòng thử lại"
-        return SendMessageResponse(
-            success=True,
-            response=response,
-            session_id=session_id
+            raise RuntimeError("Lỗi hệ thống. Vui lòng thử lại")
+        return response
+
+    try:
+        task_id = task_manager.submit(job, owner=user_id, webhook_url=request.webhook_url)
+    except TaskQueueFullError:
+        raise HTTPException(
+            status_code=503,
+            detail="Hệ thống đang quá tải. Vui lòng thử lại sau",
+            headers={"Retry-After": "5"},
         )
-        
-    except Exception as e:
+    return SubmitTaskResponse(
+        success=True,
+        task_id=task_id,
+        status_url=f"/api/task/{task_id}",
+        session_id=session_id
+    )
+
+@app.get("/api/task/{task_id}", response_model=TaskStatusResponse)
+async def get_task(task_id: str, raw_request: Request):
+    """Lấy trạng thái / kết quả của task chạy nền"""
+    claims = authenticate(raw_request)
+    user_id = claims.sub
+    record = task_manager.get(task_id)
+    if not record or record["owner"] != user_id:
         raise HTTPException(
-            status_code=500,
-            detail=f"Failed to process message: {str(e)}"
+            status_code=404,
+            detail="Task not found"
+        )
+    return TaskStatusResponse(
+        success=record["status"] != "failed",
+        task_id=task_id,
+        status=record["status"],
+        response=record["result"],
+        error=record["error"]
+    )
+
+@app.post("/api/message/batch")
+async def send_message_batch(request: BatchMessageRequest,raw_request: Request):
+    """API gửi nhiều tin nhắn một lúc, trả kết quả dạng NDJSON theo thứ tự hoàn thành"""
+    claims = authenticate(raw_request)
+    user_id = claims.sub
+    if not user_id:
+        raise HTTPException(
+            status_code=400,
+            detail="user_id is error in token, please login again"
+        )
+    if await user_flow(claims) not in BATCH_ALLOWED_USER_TYPES:
+        raise HTTPException(
+            status_code=403,
+            detail="Bạn không có quyền gửi tin nhắn theo batch"
+        )
+    if not request.items:
+        raise HTTPException(
+            status_code=400,
+            detail="items is required"
+        )
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Tối đa {BATCH_MAX_ITEMS} tin nhắn mỗi batch"
         )
+    concurrency = max(1, min(request.concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    semaphore = asyncio.Semaphore(concurrency)
+    results: asyncio.Queue = asyncio.Queue()
 
+    # Các tin nhắn cùng session chạy tuần tự để giữ đúng thứ tự lịch sử hội thoại
+    groups: dict[str, list[tuple[int, BatchMessageItem]]] = {}
+    for index, item in enumerate(request.items):
+        groups.setdefault(item.session_id, []).append((index, item))
 
-@app.get("/image/{image_name}")
-async def get_image(image_name: str):
-    file_path = os.path.join(IMAGE_DIR, image_name)
+    async def run_group(group: list[tuple[int, BatchMessageItem]]):
+        for index, item in group:
+            result = {"index": index, "id": item.id, "session_id": item.session_id}
+            try:
+                if not item.message:
+                    raise ValueError("Message is required")
+                # Mỗi tin nhắn tính một token từ bucket batch riêng của user (chat tương tác không bị ảnh hưởng); batch chạy theo tốc độ giới hạn thay vì bị từ chối
+                await admission.wait_rate(user_id)
+                async with semaphore, admission.batch_slot():
+                    response = await answer_message(claims, item.session_id, item.message, shed=False)
+                result.update(success=bool(response), response=response or {"text": "Lỗi hệ thống. Vui lòng thử lại"})
+            except Exception as e:
+                result.update(success=False, response={"text": f"Lỗi hệ thống. Vui lòng thử lại: {str(e)}"})
+            await results.put(result)
+
+    async def ndjson():
+        workers = [asyncio.create_task(run_group(group)) for group in groups.values()]
+        try:
+            for _ in range(len(request.items)):
+                result = await results.get()
+                yield json.dumps(result, ensure_ascii=False, default=str) + "\n"
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
 
-    if not os.path.exists(file_path):
+@app.post("/api/message_stream")
+async def send_message_stream(request: SendMessageRequest,raw_request: Request):
+    """API gửi tin nhắn cho agent, trả kết quả dạng Server-Sent Events"""
+    claims = authenticate(raw_request)
+    if not request.message:
+        raise HTTPException(
+            status_code=400,
+            detail="Message is required"
+        )
+    user_id = claims.sub
+    session_id = request.session_id
+    if not session_id:
+        raise HTTPException(
+            status_code=400,
+            detail="session_id is required"
+        )
+    if not user_id:
+        raise HTTPException(
+            status_code=400,
+            detail="user_id is error in token, please login again"
+        )
+
+    admission.check_rate(user_id)
+    admission.check_capacity()
+
+    async def event_source():
+        try:
+            async with admission.slot(await user_flow(claims)):
+                async for item in host.stream_response(claims, session_id, request.message):
+                    yield f"event: {item['type']}\ndata: {json.dumps(item, ensure_ascii=False, default=str)}\n\n"
+        except Exception as e:
+            error = {"type": "error", "error": f"Lỗi hệ thống. Vui lòng thử lại: {str(e)}"}
+            yield f"event: error\ndata: {json.dumps(error, ensure_ascii=False)}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket, session_id: str, token: Optional[str] = None):
+    """Kênh chat WebSocket: xác thực một lần khi kết nối, sau đó stream sự kiện cho từng tin nhắn"""
+    token = token or websocket.headers.get("Authorization", "").replace("Bearer ", "")
+    try:
+        claims = verify_token(token)
+    except TokenError as e:
+        await websocket.close(code=4401, reason=str(e))
+        return
+    user_id = claims.sub
+    session = await session_service.get_session(
+        app_name=AGENT_NAME, user_id=user_id, session_id=session_id
+    ) if user_id else None
+    if session is None:
+        await websocket.close(code=4404, reason="Session not found")
+        return
+    # Fast path và runner dùng lại session này cho mọi tin nhắn, chỉ kiểm tra xem DB có bản mới hơn không
+    bound_session.set(session)
+
+    await websocket.accept()
+    try:
+        while True:
+            data = await websocket.receive_json()
+            message = (data or {}).get("message")
+            if not message:
+                await websocket.send_json({"type": "error", "error": "Message is required"})
+                continue
+            if claims.expired:
+                await websocket.close(code=4401, reason="Token đã hết hạn")
+                return
+            try:
+                admission.check_rate(user_id)
+                async with admission.slot(await user_flow(claims)):
+                    async for item in host.stream_response(claims, session_id, message):
+                        await websocket.send_text(json.dumps(item, ensure_ascii=False, default=str))
+            except WebSocketDisconnect:
+                raise
+            except AdmissionError as e:
+                await websocket.send_json({"type": "error", "error": str(e), "retry_after": math.ceil(e.retry_after)})
+            except Exception as e:
+                await websocket.send_json({"type": "error", "error": f"Lỗi hệ thống. Vui lòng thử lại: {str(e)}"})
+            await websocket.send_json({"type": "done"})
+    except WebSocketDisconnect:
+        pass
+
+
+def _read_range(file_path: str, start: int, length: int) -> bytes:
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+
+@app.get("/image/{image_name}")
+async def get_image(image_name: str, raw_request: Request):
+    file_path = image_store.path(image_name)
+    if not file_path or not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Image not found")
 
-    return FileResponse(file_path, media_type="image/png")
+    stat = os.stat(file_path)
+    media_type = mimetypes.guess_type(image_name)[0] or "application/octet-stream"
+    etag = f'"{os.path.splitext(image_name)[0]}-{stat.st_size}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        # Tên file là hash nội dung nên có thể cache lâu dài
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if raw_request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    range_header = raw_request.headers.get("range")
+    if range_header:
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+        if not match or match.groups() == ("", ""):
+            raise HTTPException(status_code=416, detail="Invalid range")
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), stat.st_size - 1) if last else stat.st_size - 1
+        else:
+            start = max(stat.st_size - int(last), 0)
+            end = stat.st_size - 1
+        if start > end or start >= stat.st_size:
+            raise HTTPException(
+                status_code=416,
+                detail="Range not satisfiable",
+                headers={"Content-Range": f"bytes */{stat.st_size}"},
+            )
+        data = await asyncio.to_thread(_read_range, file_path, start, end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        return Response(content=data, status_code=206, media_type=media_type, headers=headers)
+
+    return FileResponse(file_path, media_type=media_type, headers=headers)
 
 
 @app.get("/api/health", response_model=HealthResponse)
@@ -267,7 +580,18 @@ async def health_check():
     """Health check endpoint"""
     return HealthResponse(
         status="healthy",
-        agent_name=AGENT_NAME
+        agent_name=AGENT_NAME,
+        agents=host.agent_health() if host else None,
+        caches={
+            "response": response_cache.stats(),
+            "remote_singleflight": remote_flight.stats(),
+            "agent_singleflight": agent_flight.stats(),
+            "jwt_claims": claims_cache.stats(),
+        },
+        admission=admission.stats(),
+        schedulers={"llm": llm_scheduler.stats()},
+        tasks=task_manager.stats(),
+        sessions=session_service.stats()
     )
 
 @app.get("/api/session/{session_id}/{user_id}")
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
+
+from .cache import TTLCache
+from .scheduler import DEFAULT_FLOW, FairScheduler
+
+# Token bucket cho từng user: số tin nhắn mỗi phút và số tin nhắn được gửi dồn
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+# Bucket của user không hoạt động quá số giây này được bỏ đi (khi đó bucket đã đầy lại)
+RATE_LIMIT_IDLE = float(os.getenv("RATE_LIMIT_IDLE", "600"))
+RATE_LIMIT_USERS = int(os.getenv("RATE_LIMIT_USERS", "100000"))
+# Số lượt chạy LLM đồng thời của cả host và số request được xếp hàng chờ, vượt quá trả 503
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+# Thời gian chờ tối đa (giây) trong hàng đợi trước khi trả 503
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+# Tỉ lệ slot của host mà toàn bộ các batch được dùng cùng lúc, phần còn lại dành cho tin nhắn tương tác
+BATCH_INFLIGHT_SHARE = float(os.getenv("BATCH_INFLIGHT_SHARE", "0.25"))
+# Số request đồng thời tối đa tới mỗi agent, ví dụ {"AgentExecutor": 4}
+AGENT_MAX_CONCURRENCY = int(os.getenv("AGENT_MAX_CONCURRENCY", "16"))
+AGENT_MAX_CONCURRENCY_BY_AGENT: dict[str, int] = json.loads(
+    os.getenv("AGENT_MAX_CONCURRENCY_BY_AGENT", "") or "{}"
+)
+# Thời gian chờ tối đa (giây) để có chỗ gọi một agent đang bận
+AGENT_QUEUE_TIMEOUT = float(os.getenv("AGENT_QUEUE_TIMEOUT", "15"))
+
+
+class AdmissionError(Exception):
+    """Base class of the load-shedding errors; carries the Retry-After hint in seconds."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitedError(AdmissionError):
+    """Raised when a user has used up their token bucket."""
+
+    status_code = 429
+
+
+class OverloadedError(AdmissionError):
+    """Raised when the host queue is full or a request waited too long for a slot."""
+
+    status_code = 503
+
+
+class AgentBusyError(Exception):
+    """Raised when no slot for a remote agent frees up within AGENT_QUEUE_TIMEOUT."""
+
+    pass
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` tokens per second."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1.0) -> float:
+        """Takes `cost` tokens; returns 0 on success or the seconds to wait until they are available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        if self.rate <= 0:
+            return RATE_LIMIT_IDLE
+        return (cost - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Per-user rate limits, a global in-flight/queue limit and per-agent concurrency limits."""
+
+    def __init__(self):
+        self._buckets = TTLCache(maxsize=RATE_LIMIT_USERS, ttl=RATE_LIMIT_IDLE)
+        # Hàng đợi công bằng theo user_type: báo cáo nặng của quản lý không chiếm hết slot của học sinh
+        self._inflight = FairScheduler("host", ADMISSION_MAX_INFLIGHT)
+        self._batch = asyncio.Semaphore(max(1, int(ADMISSION_MAX_INFLIGHT * BATCH_INFLIGHT_SHARE)))
+        self._agents: dict[str, FairScheduler] = {}
+        self.rate_limited = 0
+        self.shed = 0
+
+    def _take(self, user_id: str) -> float:
+        if RATE_LIMIT_PER_MINUTE <= 0:
+            return 0.0
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(RATE_LIMIT_PER_MINUTE / 60, RATE_LIMIT_BURST)
+        self._buckets.set(user_id, bucket)
+        return bucket.take()
+
+    def check_rate(self, user_id: str) -> None:
+        """Charges the user's bucket; raises RateLimitedError when it is empty."""
+        wait = self._take(user_id)
+        if wait:
+            self.rate_limited += 1
+            raise RateLimitedError("Bạn gửi tin nhắn quá nhanh. Vui lòng thử lại sau", retry_after=wait)
+
+    async def wait_rate(self, user_id: str) -> None:
+        """
+        Charges the user's batch bucket, sleeping until a token is available (batch
+        items are throttled, not rejected). Kept apart from the interactive bucket so
+        a long batch does not lock the user out of chat.
+        """
+        while wait := self._take(f"batch:{user_id}"):
+            await asyncio.sleep(wait)
+
+    @asynccontextmanager
+    async def batch_slot(self) -> AsyncIterator[None]:
+        """Caps all batch work together at BATCH_INFLIGHT_SHARE of the host slots."""
+        async with self._batch:
+            yield
+
+    def check_capacity(self) -> None:
+        """Fails fast with OverloadedError when the admission queue is already full."""
+        if self._inflight.in_use >= self._inflight.capacity and self._inflight.queued >= ADMISSION_MAX_QUEUE:
+            self.shed += 1
+            raise OverloadedError("Hệ thống đang quá tải. Vui lòng thử lại sau", retry_after=ADMISSION_QUEUE_TIMEOUT)
+
+    @asynccontextmanager
+    async def slot(self, flow: str = DEFAULT_FLOW, shed: bool = True) -> AsyncIterator[None]:
+        """
+        Holds one of the ADMISSION_MAX_INFLIGHT host slots for the duration of the block.
+
+        Waiters are served in weighted fair order by `flow` (user_type). With
+        shed=True (interactive requests) a full queue or a wait longer than
+        ADMISSION_QUEUE_TIMEOUT raises OverloadedError; background work passes
+        shed=False and simply waits, since its own queue is already bounded.
+        """
+        if shed:
+            self.check_capacity()
+        try:
+            if shed:
+                await asyncio.wait_for(self._inflight.acquire(flow), timeout=ADMISSION_QUEUE_TIMEOUT)
+            else:
+                await self._inflight.acquire(flow)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            raise OverloadedError("Hệ thống đang quá tải. Vui lòng thử lại sau", retry_after=ADMISSION_QUEUE_TIMEOUT)
+        try:
+            yield
+        finally:
+            self._inflight.release()
+
+    def _agent_scheduler(self, agent_name: str) -> FairScheduler:
+        scheduler = self._agents.get(agent_name)
+        if scheduler is None:
+            limit = int(AGENT_MAX_CONCURRENCY_BY_AGENT.get(agent_name, AGENT_MAX_CONCURRENCY))
+            scheduler = self._agents[agent_name] = FairScheduler(agent_name, limit)
+        return scheduler
+
+    @asynccontextmanager
+    async def agent_slot(self, agent_name: str, flow: str = DEFAULT_FLOW) -> AsyncIterator[None]:
+        """
+        Limits concurrent calls to one remote agent, serving waiters in weighted fair
+        order by `flow` (user_type); raises AgentBusyError after AGENT_QUEUE_TIMEOUT.
+        """
+        scheduler = self._agent_scheduler(agent_name)
+        try:
+            await asyncio.wait_for(scheduler.acquire(flow), timeout=AGENT_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise AgentBusyError(f"Agent {agent_name} đang quá tải")
+        try:
+            yield
+        finally:
+            scheduler.release()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "inflight": self._inflight.in_use,
+            "waiting": self._inflight.queued,
+            "rate_limited": self.rate_limited,
+            "shed": self.shed,
+            "host": self._inflight.stats(),
+            "agents": {name: scheduler.stats() for name, scheduler in self._agents.items()},
+        }
+
+
+admission = AdmissionController()
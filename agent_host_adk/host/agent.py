@@ -1,6 +1,9 @@
 import asyncio
-import json
+import copy
+import re
+import unicodedata
 import uuid
+from contextvars import ContextVar
 from datetime import datetime
 from typing import Any, AsyncIterable, List
 
@@ -9,29 +12,57 @@ import nest_asyncio
 from a2a.client import A2ACardResolver
 from a2a.types import (
     AgentCard,
+    Artifact,
+    FileWithBytes,
+    FileWithUri,
     MessageSendParams,
     SendMessageRequest,
     SendMessageResponse,
     SendMessageSuccessResponse,
+    SendStreamingMessageRequest,
     Task,
+    TaskArtifactUpdateEvent,
+    TaskStatusUpdateEvent,
+    TextPart,
 )
 from dotenv import load_dotenv
 from google.adk import Agent
 from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.adk.artifacts import InMemoryArtifactService
 from google.adk.memory.in_memory_memory_service import InMemoryMemoryService
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from google.adk.tools.tool_context import ToolContext
+from google.adk.events import Event, EventActions
 from google.genai import types
 from typing import Any, AsyncIterable, List, Optional  # Đảm bảo import MappingProxyType nếu bạn dùng Python 3.9 trở lên
-from google.adk.sessions import DatabaseSessionService 
 import os
 from google.adk.models import LlmResponse, LlmRequest
 from google.adk.agents.callback_context import CallbackContext
-from .remote_agent_connection import RemoteAgentConnections
+from .remote_agent_connection import (
+    AgentHealth,
+    AgentReplicaSet,
+    AGENT_TIMEOUT,
+    AgentUnavailableError,
+    RemoteAgentConnections,
+    WRITE_AGENTS,
+)
+from .cache import TTLCache
+from .history import compact_history
+from .context_cache import context_cache
+from .router import FastPathRouter
+from .envelope import build_context_envelope
+from .admission import AgentBusyError, admission
+from .artifacts import extract_parts
+from .scheduler import DEFAULT_FLOW, llm_leases
+from .auth import Claims
+from .image_store import image_store
+from .singleflight import SingleFlight
+from .sessions import BoundedSessionService
+from .transport import build_timeout, get_http_client
+from .util import flush_session, process_agent_response
 import logging
-import base64
 
 #######################################################################################
 #############                                                             #############
@@ -46,51 +77,57 @@ nest_asyncio.apply()
 llm_model = os.getenv("LLM_MODEL")
 db_url = os.getenv("DB_URL")
 
-session_service = DatabaseSessionService(db_url=db_url) 
-
-IMAGE_URL = os.getenv("IMAGE_URL","http://localhost:9000/image/")
-async def store_file_temporarily(file:str ) -> str:
-    """Store a File from base 64 to ."""
+# Thời gian chờ đọc agent card khi khởi tạo
+CARD_TIMEOUT = float(os.getenv("CARD_TIMEOUT", "30"))
+# Chu kỳ (giây) làm mới agent card ở nền, 0 để tắt
+AGENT_REFRESH_INTERVAL = float(os.getenv("AGENT_REFRESH_INTERVAL", "60"))
+
+# Cache câu trả lời của các agent chỉ đọc (bỏ qua WRITE_AGENTS)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+# Agent có câu trả lời chỉ phụ thuộc vào quyền (user_type, agent_use), không phụ thuộc từng user
+RESPONSE_CACHE_SHARED_AGENTS = {
+    name.strip()
+    for name in os.getenv("RESPONSE_CACHE_SHARED_AGENTS", "RagSchoolInfo").split(",")
+    if name.strip()
+}
+response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+remote_flight = SingleFlight()
+
+session_service = BoundedSessionService(db_url=db_url)
+# Hàng đợi sự kiện của request streaming đang chạy lượt agent này (SSE hoặc WebSocket)
+stream_channel: ContextVar[Optional[asyncio.Queue]] = ContextVar("stream_channel", default=None)
+
+async def store_file_temporarily(file: FileWithBytes | FileWithUri) -> str:
+    """Store a File from base 64 in the image store and return its URL."""
     try:
-        image_bytes = base64.b64decode(file.get("bytes"))
-        id = uuid.uuid4()
-        # Lưu thành file PNG
-        with open(f"host/imgs/baocao_{id}.png", "wb") as f:
-            f.write(image_bytes)
-        return IMAGE_URL + f"baocao_{id}.png"
+        if isinstance(file, FileWithUri):
+            # blob:// -> ảnh đã được agent ghi sẵn vào thư mục ảnh dùng chung, không cần copy bytes
+            return image_store.resolve_uri(file.uri)
+        return await image_store.put_base64(file.bytes, file.mimeType)
     except Exception as e:
         print(f"Error storing file temporarily: {e}")
         return None
 
 
-async def before_model_callback(
-    callback_context: CallbackContext, llm_request: LlmRequest
-) -> Optional[LlmResponse]:
-    HISTORY_LENGTH = int(os.environ.get("HISTORY_LENGTH","5"))
+def normalize_task(task: str) -> str:
+    """Normalizes task text (unicode, case, whitespace, trailing punctuation) for cache keys."""
+    text = unicodedata.normalize("NFC", task or "").lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(" ?.!…")
 
-    if not llm_request.contents:
-        return None
 
-    user_indices = [
-        i
-        for i, item in enumerate(llm_request.contents)
-        if item.role == "user" and item.parts and item.parts[0].text
-    ]
+def _user_type(state: Any) -> str:
+    """Scheduling flow of a request: the user_type of the session's user_info."""
+    user_info = state.get("user_info") or {}
+    return (user_info.get("user_type") if isinstance(user_info, dict) else None) or DEFAULT_FLOW
 
-    if not user_indices:
-        return None
 
-    hist = HISTORY_LENGTH + 1
-    keep_turns = min(hist, len(user_indices))
-    start_user_idx = user_indices[-keep_turns]
-
-    temp_context = llm_request.contents[start_user_idx:]
-    filtered_items = [
-    item for item in temp_context
-    if hasattr(item.parts[0], "text") and item.parts[0].text
-    ]
-
-    llm_request.contents = filtered_items
+async def before_model_callback(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> Optional[LlmResponse]:
+    compact_history(callback_context, llm_request)
     return None
 
 
@@ -146,9 +183,13 @@ class HostAgent:
         self,
         name_agent:str
     ):
-        self.remote_agent_connections: dict[str, RemoteAgentConnections] = {}
+        self.remote_agent_connections: dict[str, AgentReplicaSet] = {}
         self.cards: dict[str, AgentCard] = {}
         self.agents: str = ""
+        self._static_instruction: Optional[str] = None
+        self.router = FastPathRouter()
+        self.remote_agent_addresses: list[str] = []
+        self._refresh_task: Optional[asyncio.Task] = None
         self._agent = self.create_agent(name_agent)
         self._user_id = "host_agent"
         self.runner = Runner(
@@ -156,27 +197,57 @@ class HostAgent:
             agent=self._agent,
             session_service=session_service,
         )
-    async def _async_init_components(self, remote_agent_addresses: List[str]):
-        async with httpx.AsyncClient(timeout=30) as client:
-            for address in remote_agent_addresses:
-                card_resolver = A2ACardResolver(client, address)
-                try:
-                    
-                    card = await card_resolver.get_agent_card()
-                    card.url = address
-                    remote_connection = RemoteAgentConnections(
-                        agent_card=card, agent_url=address
-                    )
-                    
-                    self.remote_agent_connections[card.name] = remote_connection
-                    self.cards[card.name] = card
-                except httpx.ConnectError as e:
-                    print(f"ERROR: Failed to get agent card from {address}: {e}")
-                except Exception as e:
-                    print(f"ERROR: Failed to initialize connection for {address}: {e}")
-        # agent_info = [
-        #     json.dumps({"name": card.name, "description": card.description, "skills": card_skill})
-        # ]
+    async def _resolve_card(self, address: str) -> Optional[AgentCard]:
+        """Fetches the agent card at `address`, or returns None if the agent is unreachable."""
+        card_resolver = A2ACardResolver(get_http_client(), address)
+        try:
+            card = await card_resolver.get_agent_card(
+                http_kwargs={"timeout": build_timeout(read=CARD_TIMEOUT)}
+            )
+            card.url = address
+            return card
+        except httpx.ConnectError as e:
+            print(f"ERROR: Failed to get agent card from {address}: {e}")
+        except Exception as e:
+            print(f"ERROR: Failed to initialize connection for {address}: {e}")
+        return None
+
+    async def refresh_agents(self):
+        """Resolves all agent cards concurrently and rebuilds the connections and `self.agents`."""
+        addresses = list(self.remote_agent_addresses)
+        cards = await asyncio.gather(*(self._resolve_card(address) for address in addresses))
+        existing = {
+            replica.agent_url: replica
+            for replica_set in self.remote_agent_connections.values()
+            for replica in replica_set.replicas
+        }
+        replicas: dict[str, list[RemoteAgentConnections]] = {}
+        new_cards: dict[str, AgentCard] = {}
+        for address, card in zip(addresses, cards):
+            if card is None:
+                continue
+            remote_connection = existing.get(address)
+            if remote_connection is not None and remote_connection.card.name == card.name:
+                # Giữ lại kết nối cũ (và thống kê health), chỉ cập nhật card mới
+                remote_connection.card = card
+            else:
+                remote_connection = RemoteAgentConnections(
+                    agent_card=card, agent_url=address
+                )
+            # Nhiều địa chỉ cùng tên agent được gom thành một replica set
+            replicas.setdefault(card.name, []).append(remote_connection)
+            new_cards.setdefault(card.name, card)
+        connections = {
+            name: AgentReplicaSet(name, replica_list)
+            for name, replica_list in replicas.items()
+        }
+
+        for name in new_cards.keys() - self.cards.keys():
+            print(f"Agent {name} is online")
+        for name in self.cards.keys() - new_cards.keys():
+            print(f"Agent {name} is offline")
+        self.remote_agent_connections = connections
+        self.cards = new_cards
         agent_info = [
             {
                 "name": card.name,
@@ -188,10 +259,55 @@ class HostAgent:
             }
             for card in self.cards.values()
         ]
-        # agent_info = 
-        
-        print("agent_info:", "\n".join([str(info) for info in agent_info]) if agent_info else "No agent found")
-        self.agents = "\n".join([str(info) for info in agent_info]) if agent_info else "No agent found"
+        agents = "\n".join([str(info) for info in agent_info]) if agent_info else "No agent found"
+        if agents != self.agents:
+            self.agents = agents
+            self._static_instruction = None
+            await self.router.fit(self.cards)
+
+    def agent_health(self) -> dict[str, dict[str, Any]]:
+        """Returns the circuit-breaker state and rolling stats of every remote agent replica."""
+        return {
+            name: replica_set.snapshot()
+            for name, replica_set in self.remote_agent_connections.items()
+        }
+
+    def agent_status_text(self) -> str:
+        """Lists agents whose circuit is not closed, for the orchestrator prompt."""
+        lines = []
+        for name, replica_set in self.remote_agent_connections.items():
+            state = replica_set.state
+            if state == AgentHealth.OPEN:
+                lines.append(f"- {name}: đang gián đoạn, KHÔNG gọi agent này")
+            elif state == AgentHealth.HALF_OPEN:
+                lines.append(f"- {name}: đang phục hồi, chỉ gọi khi thật sự cần")
+        return "\n".join(lines) if lines else "Tất cả agent hoạt động bình thường"
+
+    async def _async_init_components(self, remote_agent_addresses: List[str]):
+        self.remote_agent_addresses = list(remote_agent_addresses)
+        await self.refresh_agents()
+        print("agent_info:", self.agents)
+        if AGENT_REFRESH_INTERVAL > 0:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        """Periodically re-fetches agent cards so agents that recover come back without a restart."""
+        while True:
+            await asyncio.sleep(AGENT_REFRESH_INTERVAL)
+            try:
+                await self.refresh_agents()
+            except Exception as e:
+                print(f"ERROR: Failed to refresh agent cards: {e}")
+
+    async def close(self):
+        """Stops the background card refresh loop."""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
 
     @classmethod
     async def create(
@@ -211,41 +327,112 @@ class HostAgent:
             description="Bạn là một agent điều phối (orchestrator) chịu trách nhiệm điều hướng các yêu cầu của người dùng tới đúng các Agent khác để sử lý.",
             tools=[
                 self.send_message,
+                self.send_message_many,
             ],
-            before_model_callback=before_model_callback
+            before_model_callback=self.before_model_callback,
+            after_model_callback=self.after_model_callback,
+            after_agent_callback=self.after_agent_callback,
             
             # before_agent_callback=
         )
 
-    def root_instruction(self, context: ReadonlyContext) -> str:
-        lang= context.state.get("lang")
-        user_info= context.state.get("user_info")
-        text = f"""
+    def static_instruction(self) -> str:
+        """The stable part of the system prompt; only changes when the agent list changes."""
+        if self._static_instruction is None:
+            self._static_instruction = f"""
             Vai trò: Bạn là một agent điều phối (orchestrator) của hệ thống Trường Đại học Công Thương TP.HCM (HUIT).
             Người dùng có thể là sinh viên, giảng viên, cán bộ quản lý hoặc người quan tâm đến trường.
             Nhiệm vụ:
             Nhiệm vụ duy nhất của bạn là chọn đúng agent trong <Available Agents> để xử lý yêu cầu, gọi qua hàm send_message.
             - Phải đọc kỹ phần <Available Agents> trước khi thực hiện gọi hàm send_message.
             - Chỉ gọi agent có trong <Available Agents>. Không tự trả lời câu hỏi.
-            - Yêu cầu trả lời (ngôn ngữ {lang}):
+            - Không gọi agent được đánh dấu gián đoạn trong <Agent Status>; báo người dùng thử lại sau.
+            - Yêu cầu trả lời bằng ngôn ngữ được ghi trong <Session Context>.
             - Nếu tất cả agent sau quá trình gọi tới đều không có dữ liệu, báo: "Không tìm thấy thông tin phù hợp trong hệ thống.".
             - Nếu người dùng gọi tới hỏi những câu hỏi cơ bản như giới thiệu chào hỏi thì bạn có thể trả lời trực tiếp.
             Quy tắc xử lý:
             1) Phân tích câu hỏi → xác định từ khóa.
             2) Đọc kỹ <Available Agents> → chọn agent phù hợp.
             3) Gọi send_message tới agent đó.
+            4) Nếu câu hỏi cần dữ liệu từ nhiều agent cùng lúc, gọi send_message_many một lần với
+               hai danh sách cùng độ dài agent_names và tasks (tasks[i] gửi cho agent_names[i]) thay vì gọi send_message nhiều lần,
+               sau đó tổng hợp các kết quả (bỏ qua agent có status "timeout" hoặc "error").
             Lưu ý: 
             - KHÔNG trả lời khi chưa gọi agent.
             - Ưu tiên tốc độ: chọn agent nhanh, gọi ngay, trả kết quả thẳng.
-
-           Ngày hiện tại (YYYY-MM-DD):** {datetime.now().strftime("%Y-%m-%d")}
-            Thông tin người dùng:
-            {user_info}
             <Available Agents>
             {self.agents}
             </Available Agents>
         """
-        return text
+        return self._static_instruction
+
+    def dynamic_instruction(self, context: ReadonlyContext) -> str:
+        """The small per-request part of the system prompt, appended after the static prefix."""
+        lang= context.state.get("lang")
+        user_info= context.state.get("user_info")
+        return f"""
+            <Session Context>
+            Ngôn ngữ trả lời: {lang}
+            Ngày hiện tại (YYYY-MM-DD): {datetime.now().strftime("%Y-%m-%d")}
+            Thông tin người dùng:
+            {user_info}
+            </Session Context>
+            <Agent Status>
+            {self.agent_status_text()}
+            </Agent Status>
+        """
+
+    def root_instruction(self, context: ReadonlyContext) -> str:
+        # Phần tĩnh đặt trước để provider có thể cache prefix giữa các lần gọi
+        return self.static_instruction() + self.dynamic_instruction(context)
+
+    async def before_model_callback(
+        self, callback_context: CallbackContext, llm_request: LlmRequest
+    ) -> Optional[LlmResponse]:
+        await before_model_callback(callback_context, llm_request)
+        if context_cache.enabled:
+            await self._apply_context_cache(llm_request)
+        # Xếp hàng công bằng theo user_type trước khi gọi LLM, trả slot trong after_model_callback
+        try:
+            await llm_leases.acquire(callback_context.invocation_id, _user_type(callback_context.state))
+        except asyncio.TimeoutError:
+            # Bỏ qua lần gọi model, trả lời ngay thay vì treo request
+            return LlmResponse(
+                content=types.Content(
+                    role="model",
+                    parts=[types.Part(text="Hệ thống đang quá tải. Vui lòng thử lại sau.")],
+                )
+            )
+        return None
+
+    async def after_model_callback(
+        self, callback_context: CallbackContext, llm_response: LlmResponse
+    ) -> Optional[LlmResponse]:
+        # Khi streaming, callback được gọi cho từng phần; chỉ trả slot khi có phản hồi hoàn chỉnh
+        if not llm_response.partial:
+            llm_leases.release(callback_context.invocation_id)
+        return None
+
+    async def after_agent_callback(self, callback_context: CallbackContext) -> None:
+        llm_leases.release(callback_context.invocation_id)
+        return None
+
+    async def _apply_context_cache(self, llm_request: LlmRequest) -> None:
+        """Moves the static prefix and tools into an explicit cached content."""
+        config = llm_request.config
+        system_instruction = config.system_instruction if config else None
+        prefix = self.static_instruction()
+        if not isinstance(system_instruction, str) or not system_instruction.startswith(prefix):
+            return
+        cache_name = await context_cache.get(llm_request.model or llm_model, prefix, config.tools)
+        if not cache_name:
+            return
+        # Khi dùng cached content, system_instruction và tools phải nằm trong cache
+        config.cached_content = cache_name
+        config.system_instruction = None
+        config.tools = None
+        suffix = system_instruction[len(prefix):]
+        llm_request.contents.insert(0, types.Content(role="user", parts=[types.Part(text=suffix)]))
     async def stream(
         self,
         query: str,
@@ -271,58 +458,234 @@ class HostAgent:
                 session_id=session_id,
             )
         
-        if initial_state_delta:
-            current_session_state = dict(session.state)
-            current_session_state.update(initial_state_delta) # Cập nhật state với delta
-            
-            await self.runner.session_service.__update_session_state(
-                app_name=self._agent.name,
-                user_id=self._user_id,
-                session_id=session.id,
-                state=current_session_state, # Truyền dict đã sửa đổi vào đây
-            )
-        # --------------------------------------------------------
-
-        async for event in self.runner.run_async(
-            user_id=self._user_id,
-            session_id=session.id,
-            new_message=content,
-            state_delta=initial_state_delta 
-        ):
-            if event.is_final_response():
-                response = ""
-                if (
-                    event.content
-                    and event.content.parts
-                    and event.content.parts[0].text
+        # Delta chỉ được ghi một lần, cùng event tin nhắn của người dùng; session service
+        # gom các event của lượt này và ghi xuống DB khi có câu trả lời cuối
+        try:
+            with llm_leases.run_scope():
+                async for event in self.runner.run_async(
+                    user_id=self._user_id,
+                    session_id=session.id,
+                    new_message=content,
+                    state_delta=initial_state_delta or None,
                 ):
-                    response = "\n".join(
-                        [p.text for p in event.content.parts if p.text]
-                    )
-                yield {
-                    "is_task_complete": True,
-                    "content": response,
-                }
-            else:
-                yield {
-                    "is_task_complete": False,
-                    "updates": "The host agent is thinking...",
-                }
+                    if event.is_final_response():
+                        response = ""
+                        if (
+                            event.content
+                            and event.content.parts
+                            and event.content.parts[0].text
+                        ):
+                            response = "\n".join(
+                                [p.text for p in event.content.parts if p.text]
+                            )
+                        yield {
+                            "is_task_complete": True,
+                            "content": response,
+                        }
+                    else:
+                        yield {
+                            "is_task_complete": False,
+                            "updates": "The host agent is thinking...",
+                        }
+        finally:
+            await flush_session(self.runner, self._user_id, session.id)
+
+
+
+
+    async def try_fast_path(
+        self,
+        claims: Claims,
+        session_id: str,
+        query: str,
+    ) -> Optional[dict[str, Any]]:
+        """
+        Answers the query without the host LLM when the local router is confident.
 
+        The query is forwarded verbatim to the matched agent and both turns are appended
+        to the session, so the LLM sees them on later turns. Returns None to fall back
+        to the LLM (low confidence, no permission, agent down or agent error).
+        """
+        match = await self.router.route(query)
+        if match is None:
+            return None
+        agent_name, score = match
+        if agent_name in WRITE_AGENTS:
+            # Agent có tác dụng ghi luôn đi qua LLM: không gửi nguyên văn câu người dùng,
+            # và tránh ghi hai lần khi fast path lỗi rồi LLM gọi lại
+            return None
+        replica_set = self.remote_agent_connections.get(agent_name)
+        if replica_set is None or replica_set.state == AgentHealth.OPEN:
+            return None
+        user_id = claims.sub
+        session = await self.runner.session_service.get_session(
+            app_name=self._agent.name, user_id=user_id, session_id=session_id
+        )
+        if session is None or agent_name not in (session.state.get("agent_use") or []):
+            return None
+
+        print(f"Fast path: routing to {agent_name} (score={score:.2f})")
+        state = {**session.state, "token": claims.token}
+        try:
+            resp = await self._call_remote_agent(agent_name, query, state, session_id, user_id)
+        except Exception as e:
+            print(f"Fast path to {agent_name} failed, falling back to LLM: {e}")
+            return None
+        if not isinstance(resp, list) or not resp:
+            return None
+
+        invocation_id = f"fastpath-{uuid.uuid4()}"
+        await self.runner.session_service.append_event(
+            session,
+            Event(
+                invocation_id=invocation_id,
+                author="user",
+                content=types.Content(role="user", parts=[types.Part(text=query)]),
+                actions=EventActions(state_delta={"token": claims.token}),
+            ),
+        )
+        text = "\n".join(part["text"] for part in resp if part.get("kind") == "text" and part.get("text"))
+        await self.runner.session_service.append_event(
+            session,
+            Event(
+                invocation_id=invocation_id,
+                author=self._agent.name,
+                content=types.Content(role="model", parts=[types.Part(text=text or f"[{agent_name}]")]),
+            ),
+        )
+        # Cùng định dạng với process_agent_response
+        if resp[0].get("kind") == "text":
+            return {"text": resp[0].get("text", "Lỗi không lấy được câu trả lời từ Agent")}
+        return {"result": resp}
 
+    async def stream_response(
+        self,
+        claims: Claims,
+        session_id: str,
+        query: str,
+    ) -> AsyncIterable[dict[str, Any]]:
+        """
+        Runs the host agent with partial-event streaming and yields events as they arrive.
 
+        Partial text from the host LLM and chunks from remote A2A agents (pushed by
+        send_message while this stream is open) are merged into a single iterator.
+        """
+        fast_response = await self.try_fast_path(claims, session_id, query)
+        if fast_response is not None:
+            yield {"type": "final", "response": fast_response}
+            return
+
+        content = types.Content(role="user", parts=[types.Part(text=query)])
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def _pump():
+            # Kênh gắn với task của request này (không theo session): hai stream cùng session không lẫn nhau
+            stream_channel.set(queue)
+            try:
+                with llm_leases.run_scope():
+                    async for event in self.runner.run_async(
+                        user_id=claims.sub,
+                        session_id=session_id,
+                        new_message=content,
+                        state_delta={"token": claims.token},
+                        run_config=RunConfig(streaming_mode=StreamingMode.SSE),
+                    ):
+                        await queue.put(("event", event))
+            except Exception as e:
+                print(f"Error during agent stream: {e}")
+                await queue.put(("error", str(e)))
+            finally:
+                await flush_session(self.runner, claims.sub, session_id)
+                await queue.put(("done", None))
+
+        pump_task = asyncio.create_task(_pump())
+        try:
+            while True:
+                kind, item = await queue.get()
+                if kind == "done":
+                    break
+                if kind == "error":
+                    yield {"type": "error", "error": item}
+                elif kind == "agent_delta":
+                    yield {"type": "agent_delta", **item}
+                elif item.partial:
+                    text = "".join(
+                        p.text for p in (item.content.parts if item.content and item.content.parts else []) if p.text
+                    )
+                    if text:
+                        yield {"type": "delta", "text": text}
+                elif item.get_function_calls():
+                    for call in item.get_function_calls():
+                        yield {"type": "tool_call", "name": call.name, "args": call.args}
+                elif item.is_final_response():
+                    yield {"type": "final", "response": await process_agent_response(item)}
+        finally:
+            if not pump_task.done():
+                pump_task.cancel()
 
     async def send_message(self, agent_name: str, task: str, tool_context: ToolContext):
         """Sends a task to a remote agent."""
+        resp = await self._call_remote_agent(agent_name, task, *self._tool_scope(tool_context))
+        if isinstance(resp, list) and resp:
+            tool_context.actions.skip_summarization = True
+        return resp
+
+    async def send_message_many(
+        self, agent_names: list[str], tasks: list[str], tool_context: ToolContext
+    ):
+        """Sends tasks to several remote agents at once and merges their results.
+
+        Args:
+            agent_names: Tên các agent cần gọi.
+            tasks: Yêu cầu gửi cho từng agent, tasks[i] được gửi cho agent_names[i].
+        """
+        scope = self._tool_scope(tool_context)
+
+        async def _run(agent_name: str, task: str) -> dict[str, Any]:
+            try:
+                result = await asyncio.wait_for(
+                    self._call_remote_agent(agent_name, task, *scope),
+                    timeout=AGENT_TIMEOUT,
+                )
+                return {"agent_name": agent_name, "status": "success", "result": result}
+            except asyncio.TimeoutError:
+                return {
+                    "agent_name": agent_name,
+                    "status": "timeout",
+                    "result": f"Agent {agent_name} phản hồi quá thời gian ({AGENT_TIMEOUT}s).",
+                }
+            except Exception as e:
+                print(f"ERROR: send_message_many to {agent_name} failed: {e}")
+                return {
+                    "agent_name": agent_name,
+                    "status": "error",
+                    "result": f"Agent {agent_name} gặp lỗi: {e}",
+                }
+
+        if not agent_names:
+            return "Không có agent nào được chỉ định để thực hiện yêu cầu."
+        if len(agent_names) != len(tasks):
+            return "agent_names và tasks phải có cùng số phần tử."
+        return list(await asyncio.gather(*(_run(name, task) for name, task in zip(agent_names, tasks))))
+
+    @staticmethod
+    def _tool_scope(tool_context: ToolContext) -> tuple[dict[str, Any], str, str]:
+        """Returns (session state, session_id, user_id) of the invocation calling a tool."""
+        invocation = tool_context._invocation_context
+        return tool_context.state.to_dict(), invocation.session.id, invocation.user_id
+
+    async def _call_remote_agent(
+        self, agent_name: str, task: str, state: dict[str, Any], session_id: str, user_id: str
+    ):
+        """Validates permissions, sends one task to a remote agent and unpacks its artifacts."""
         if agent_name not in self.remote_agent_connections:
             return(f"Không {agent_name} tìm thấy agent phù hợp để thực hiện yêu cầu")
         client = self.remote_agent_connections[agent_name]
-        token= tool_context.state["token"]
+        token= state.get("token")
         if not client:
             return("Agent {} không khả dụng".format(agent_name))
-        agent_can_use= tool_context.state._value.get("agent_use")
-        lang= tool_context.state._value.get("lang")
-        user_info= tool_context.state._value.get("user_info")
+        agent_can_use= state.get("agent_use") or []
+        user_info= state.get("user_info")
         # check token có invalid không
         # check agent có thể dùng
         if agent_name not in agent_can_use:
@@ -331,7 +694,50 @@ class HostAgent:
             return "Token không hợp lệ. Vui lòng đăng nhập lại."
         if user_info is None or user_info == "":
             return "Thông tin người dùng không hợp lệ. Vui lòng đăng nhập lại."
-        state = tool_context.state
+
+        cache_key = self._response_cache_key(agent_name, task, state, user_id)
+        if cache_key is not None:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                return copy.deepcopy(cached)
+        if cache_key is None:
+            return await self._dispatch_remote_agent(
+                client, agent_name, task, state
+            )
+
+        async def _fetch():
+            resp = await self._dispatch_remote_agent(
+                client, agent_name, task, state
+            )
+            if isinstance(resp, list) and resp:
+                response_cache.set(cache_key, copy.deepcopy(resp))
+            return resp
+
+        # Các câu hỏi giống hệt nhau (cùng phạm vi quyền) đang chạy dùng chung một lần gọi agent
+        return copy.deepcopy(await remote_flight.do(cache_key, _fetch))
+
+    def _response_cache_key(
+        self, agent_name: str, task: str, state: dict[str, Any], user_id: str
+    ) -> Optional[tuple]:
+        """Builds the response-cache key, or None if this agent's answers must not be cached."""
+        if not RESPONSE_CACHE_ENABLED or agent_name in WRITE_AGENTS:
+            return None
+        user_info = state.get("user_info") or {}
+        if agent_name in RESPONSE_CACHE_SHARED_AGENTS:
+            # Câu trả lời chỉ phụ thuộc vào vai trò người dùng -> dùng chung giữa các user cùng quyền
+            scope = (user_info.get("user_type"), tuple(sorted(state.get("agent_use") or [])))
+        else:
+            scope = (user_info.get("user_id") or user_id,)
+        return (agent_name, normalize_task(task), scope, state.get("lang"))
+
+    async def _dispatch_remote_agent(
+        self,
+        client: AgentReplicaSet,
+        agent_name: str,
+        task: str,
+        state: dict[str, Any],
+    ):
+        """Sends one task to a remote agent and unpacks its artifacts."""
         task_id = state.get("task_id", str(uuid.uuid4()))
         context_id = state.get("context_id", str(uuid.uuid4()))
         message_id = str(uuid.uuid4())
@@ -339,40 +745,73 @@ class HostAgent:
         payload = {
             "message": {
                 "role": "user",
-                "metadata":{
-                    "lang":lang,
-                    "user_info": user_info,
-                    "session":tool_context.state._value,
-                    "token":token
-                },
+                "metadata": build_context_envelope(agent_name, state),
                 "parts": [{"type": "text", "text": task}],
                 "messageId": message_id,
                 "taskId": task_id,
                 "contextId": context_id,
             },
         }
-        message_request = SendMessageRequest(
+        channel = stream_channel.get()
+        card = client.get_agent()
+        try:
+            async with admission.agent_slot(agent_name, _user_type(state)):
+                if channel is not None and card.capabilities and card.capabilities.streaming:
+                    artifacts = await self._stream_remote_agent(
+                        client, agent_name, message_id, payload, channel
+                    )
+                    send_response = None
+                else:
+                    message_request = SendMessageRequest(
+                        id=message_id, params=MessageSendParams.model_validate(payload)
+                    )
+                    send_response: SendMessageResponse = await client.send_message(message_request)
+        except AgentBusyError:
+            return f"Agent {agent_name} đang quá tải. Vui lòng thử lại sau."
+        except AgentUnavailableError:
+            return f"Agent {agent_name} tạm thời không khả dụng. Vui lòng thử lại sau."
+        except asyncio.TimeoutError:
+            return f"Agent {agent_name} phản hồi quá thời gian ({AGENT_TIMEOUT}s). Vui lòng thử lại sau."
+
+        if send_response is not None:
+            if not isinstance(
+                send_response.root, SendMessageSuccessResponse
+            ) or not isinstance(send_response.root.result, Task):
+                print("Received a non-success or non-task response. Cannot proceed.")
+                return
+
+            artifacts = send_response.root.result.artifacts or []
+        resp = extract_parts(artifacts)
+        for part in resp:
+            if part["kind"] == "file":
+                part["file"] = await store_file_temporarily(part["file"])
+        return resp
+
+    async def _stream_remote_agent(
+        self,
+        client: AgentReplicaSet,
+        agent_name: str,
+        message_id: str,
+        payload: dict[str, Any],
+        channel: asyncio.Queue,
+    ) -> list[Artifact]:
+        """Streams a task to a remote agent, forwarding status text to the channel and collecting artifacts."""
+        message_request = SendStreamingMessageRequest(
             id=message_id, params=MessageSendParams.model_validate(payload)
         )
-        send_response: SendMessageResponse = await client.send_message(message_request)
-
-        if not isinstance(
-            send_response.root, SendMessageSuccessResponse
-        ) or not isinstance(send_response.root.result, Task):
-            print("Received a non-success or non-task response. Cannot proceed.")
-            return
-
-        response_content = send_response.root.model_dump_json(exclude_none=True)
-        json_content = json.loads(response_content)
-        resp = []
-        if json_content.get("result", {}).get("artifacts"):
-            for artifact in json_content["result"]["artifacts"]:
-                if artifact.get("parts"):
-                    resp.extend(artifact["parts"])
-                    tool_context.actions.skip_summarization = True
-                    for part in artifact["parts"]:
-                       if part.get("file"):
-                            tool_context.actions.skip_summarization = True
-                            part["file"] = await store_file_temporarily(part["file"])
-                            
-        return resp
\ No newline at end of file
+        artifacts: list[Artifact] = []
+        async for chunk in client.send_message_stream(message_request):
+            result = getattr(chunk.root, "result", None)
+            if isinstance(result, TaskArtifactUpdateEvent):
+                artifacts.append(result.artifact)
+            elif isinstance(result, TaskStatusUpdateEvent) and result.status.message:
+                text = "".join(
+                    part.root.text
+                    for part in result.status.message.parts
+                    if isinstance(part.root, TextPart)
+                )
+                if text:
+                    await channel.put(("agent_delta", {"agent_name": agent_name, "text": text}))
+            elif isinstance(result, Task) and result.artifacts:
+                artifacts = list(result.artifacts)
+        return artifacts
\ No newline at end of file
@@ -0,0 +1,28 @@
+from typing import Any, Iterable
+
+from a2a.types import Artifact, DataPart, FilePart, TextPart
+
+
+def extract_parts(artifacts: Iterable[Artifact]) -> list[dict[str, Any]]:
+    """
+    Flattens the parts of typed A2A artifacts into plain dicts, without serializing the Task.
+
+    Text and data parts are copied by reference. File parts keep the typed
+    FileWithBytes / FileWithUri object under "file" so the caller can store it.
+    """
+    parts: list[dict[str, Any]] = []
+    for artifact in artifacts or []:
+        for part in artifact.parts or []:
+            root = part.root
+            if isinstance(root, TextPart):
+                item = {"kind": "text", "text": root.text}
+            elif isinstance(root, FilePart):
+                item = {"kind": "file", "file": root.file}
+            elif isinstance(root, DataPart):
+                item = {"kind": "data", "data": root.data}
+            else:
+                continue
+            if root.metadata is not None:
+                item["metadata"] = root.metadata
+            parts.append(item)
+    return parts
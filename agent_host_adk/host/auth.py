@@ -0,0 +1,73 @@
+import hashlib
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import jwt
+from dotenv import load_dotenv
+
+from .cache import TTLCache
+
+load_dotenv()
+
+secret_key = os.getenv("SECRET_KEY", "")
+JWT_ALGORITHMS = [a.strip() for a in os.getenv("JWT_ALGORITHMS", "HS256").split(",") if a.strip()]
+# Claims đã xác thực được cache theo hash của token, không bao giờ lâu hơn exp của token
+JWT_CACHE_TTL = float(os.getenv("JWT_CACHE_TTL", "300"))
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+
+
+class TokenError(Exception):
+    """Raised when a bearer token is missing, malformed, expired or wrongly signed."""
+
+
+@dataclass(frozen=True)
+class Claims:
+    """Verified JWT claims plus the raw token (still needed to call the backends on the user's behalf)."""
+
+    token: str
+    sub: Optional[str]
+    exp: Optional[float]
+    payload: dict[str, Any] = field(default_factory=dict, compare=False)
+
+    @property
+    def expired(self) -> bool:
+        return self.exp is not None and self.exp <= time.time()
+
+
+claims_cache = TTLCache(maxsize=JWT_CACHE_SIZE, ttl=JWT_CACHE_TTL)
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def verify_token(token: str) -> Claims:
+    """
+    Verifies the signature and expiry of a JWT and returns its claims.
+
+    Successful verifications are cached by token hash until the token expires
+    (at most JWT_CACHE_TTL seconds), so repeated requests skip the HMAC check.
+    """
+    if not token:
+        raise TokenError("Token không hợp lệ")
+    key = token_key(token)
+    claims = claims_cache.get(key)
+    if claims is not None:
+        if not claims.expired:
+            return claims
+        claims_cache.pop(key)
+
+    try:
+        payload = jwt.decode(token, secret_key, algorithms=JWT_ALGORITHMS)
+    except jwt.ExpiredSignatureError as e:
+        raise TokenError(f"Token đã hết hạn: {e}") from e
+    except jwt.InvalidTokenError as e:
+        raise TokenError("Token không hợp lệ") from e
+
+    exp = payload.get("exp")
+    claims = Claims(token=token, sub=payload.get("sub"), exp=float(exp) if exp is not None else None, payload=payload)
+    ttl = JWT_CACHE_TTL if claims.exp is None else min(JWT_CACHE_TTL, claims.exp - time.time())
+    claims_cache.set(key, claims, ttl=ttl)
+    return claims
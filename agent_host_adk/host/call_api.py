@@ -1,7 +1,11 @@
 import os
 import requests
+import httpx
 import json
 from typing import List, Dict, Any, Optional
+from .auth import token_key
+from .cache import TTLCache
+from .transport import build_timeout, get_http_client
 BASE_URL = os.getenv("URL_API_APP")
 URL_API_SYSTEM = os.getenv("URL_API_SYSTEM")
 ROUTER= {
@@ -9,6 +13,14 @@ ROUTER= {
     "get_available_agents": f"{BASE_URL}/agent_roles/enable_agent",
     "get_user_info": f"{URL_API_SYSTEM}/api/auth/profile"
 }
+# Cache kết quả tra cứu danh tính theo token (TTL + LRU) để các đợt tạo session dồn dập không gọi lại backend
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "60"))
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "2048"))
+_user_info_cache = TTLCache(maxsize=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL)
+_available_agents_cache = TTLCache(maxsize=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL)
+# Timeout đọc cho các API backend (kết nối dùng chung transport của host)
+BACKEND_READ_TIMEOUT = float(os.getenv("BACKEND_READ_TIMEOUT", "30"))
+
 
 def get_agent_urls() -> List[str]:
     """
@@ -42,9 +54,10 @@ def get_agent_urls() -> List[str]:
         print(f"Error parsing API response: {str(e)}")
         raise
 
-def get_user_info(token: str) -> Optional[Dict[str, Any]]:
+async def get_user_info(token: str) -> Optional[Dict[str, Any]]:
     """
     Calls the API endpoint to get user information.
+    Results are cached per token for IDENTITY_CACHE_TTL seconds.
 
     Args:
         token (str): Authentication token to include in the request header
@@ -53,30 +66,40 @@ def get_user_info(token: str) -> Optional[Dict[str, Any]]:
         Optional[Dict[str, Any]]: A dictionary containing user information, or None if not found
 
     Raises:
-        requests.RequestException: If there's an error with the API request
+        httpx.HTTPError: If there's an error with the API request
         ValueError: If the API returns invalid data
     """
+    key = token_key(token)
+    cached = _user_info_cache.get(key)
+    if cached is not None:
+        return cached
     headers = {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
     }
     try:
-        response = requests.get(ROUTER.get("get_user_info"), headers=headers)
+        response = await get_http_client().get(
+            ROUTER.get("get_user_info"), headers=headers, timeout=build_timeout(read=BACKEND_READ_TIMEOUT)
+        )
         response.raise_for_status()
 
         data = response.json()
-        return data.get("user")
+        user = data.get("user")
+        if user:
+            _user_info_cache.set(key, user)
+        return user
 
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Error calling user info API: {str(e)}")
         raise
     except (json.JSONDecodeError, ValueError) as e:
         print(f"Error parsing API response: {str(e)}")
         raise
 
-def get_available_agents(token: str) -> List[str]:
+async def get_available_agents(token: str) -> List[str]:
     """
     Calls the API endpoint to get a list of available agents the user can use.
+    Results are cached per token for IDENTITY_CACHE_TTL seconds.
     
     Args:
         token (str): Authentication token to include in the request header
@@ -85,9 +108,13 @@ def get_available_agents(token: str) -> List[str]:
         List[str]: A list of available agent names
     
     Raises:
-        requests.RequestException: If there's an error with the API request
+        httpx.HTTPError: If there's an error with the API request
         ValueError: If the API returns invalid data
     """
+    key = token_key(token)
+    cached = _available_agents_cache.get(key)
+    if cached is not None:
+        return cached
     api_url = ROUTER.get("get_available_agents")
 
     # Set up the request headers with the token
@@ -96,7 +123,9 @@ def get_available_agents(token: str) -> List[str]:
         "Content-Type": "application/json"
     }
     try:
-        response = requests.get(api_url, headers=headers)
+        response = await get_http_client().get(
+            api_url, headers=headers, timeout=build_timeout(read=BACKEND_READ_TIMEOUT)
+        )
         response.raise_for_status()  # Raises an exception for 4XX/5XX responses
         
         data = response.json()
@@ -104,9 +133,12 @@ def get_available_agents(token: str) -> List[str]:
         if "state" not in data:
             raise ValueError("API response doesn't contain 'agent_use' key")
         
-        return data["state"]["agent_use"]
+        agent_use = data["state"]["agent_use"]
+        if agent_use:
+            _available_agents_cache.set(key, agent_use)
+        return agent_use
     
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         # Log the error or handle it as needed
         print(f"Error calling available agents API: {str(e)}")
         raise
@@ -118,6 +150,8 @@ def get_available_agents(token: str) -> List[str]:
 
 # Example usage:
 if __name__ == "__main__":
+    import asyncio
+
     try:
         # Get list of agent URLs
         agent_urls = get_agent_urls()
@@ -125,7 +159,7 @@ if __name__ == "__main__":
         
         # Get list of available agents (requires a valid token)
         token = "your_auth_token_here"
-        available_agents = get_available_agents(token)
+        available_agents = asyncio.run(get_available_agents(token))
         print("Available agents:", available_agents)
     
     except Exception as e:
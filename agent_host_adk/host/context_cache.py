@@ -0,0 +1,68 @@
+import hashlib
+import os
+import time
+from typing import Optional
+
+from google import genai
+from google.genai import types
+
+from .singleflight import SingleFlight
+
+# "implicit": chỉ giữ prefix ổn định để provider tự cache; "explicit": tạo cached content cho prefix
+CONTEXT_CACHE_MODE = os.getenv("CONTEXT_CACHE_MODE", "implicit").lower()
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "3600"))
+# Thời gian (giây) không thử tạo lại cache sau khi tạo thất bại (ví dụ prefix quá ngắn)
+CONTEXT_CACHE_RETRY_AFTER = float(os.getenv("CONTEXT_CACHE_RETRY_AFTER", "600"))
+
+
+class ContextCacheManager:
+    """Creates and reuses explicit Gemini cached contents for the static instruction prefix."""
+
+    def __init__(self):
+        self._client: Optional[genai.Client] = None
+        # hash(model, prefix, tools) -> (tên cached content hoặc None nếu lỗi, thời điểm hết hạn)
+        self._entries: dict[str, tuple[Optional[str], float]] = {}
+        # Nhiều request cùng miss chỉ tạo một cached content (mỗi lần tạo đều tính phí)
+        self._flight = SingleFlight()
+
+    @property
+    def enabled(self) -> bool:
+        return CONTEXT_CACHE_MODE == "explicit"
+
+    def _get_client(self) -> genai.Client:
+        if self._client is None:
+            self._client = genai.Client()
+        return self._client
+
+    async def get(self, model: str, prefix: str, tools: Optional[list[types.Tool]]) -> Optional[str]:
+        """Returns the cached-content name for this prefix, creating it if needed."""
+        tools_repr = "".join(tool.model_dump_json(exclude_none=True) for tool in tools or [])
+        key = hashlib.sha256(f"{model}\0{prefix}\0{tools_repr}".encode("utf-8")).hexdigest()
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        return await self._flight.do(key, lambda: self._create(key, model, prefix, tools))
+
+    async def _create(self, key: str, model: str, prefix: str, tools: Optional[list[types.Tool]]) -> Optional[str]:
+        now = time.time()
+        try:
+            cached = await self._get_client().aio.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    display_name=f"host-prefix-{key[:12]}",
+                    system_instruction=prefix,
+                    tools=tools,
+                    ttl=f"{CONTEXT_CACHE_TTL}s",
+                ),
+            )
+            # Làm mới trước khi cache phía provider hết hạn
+            self._entries[key] = (cached.name, now + CONTEXT_CACHE_TTL * 0.9)
+            return cached.name
+        except Exception as e:
+            print(f"WARNING: Failed to create context cache, using implicit caching: {e}")
+            self._entries[key] = (None, now + CONTEXT_CACHE_RETRY_AFTER)
+            return None
+
+
+context_cache = ContextCacheManager()
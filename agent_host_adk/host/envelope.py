@@ -0,0 +1,39 @@
+import json
+import os
+from typing import Any
+
+# Phiên bản của envelope metadata gửi kèm mỗi A2A message (agent nhận đọc metadata["v"])
+ENVELOPE_VERSION = 1
+# Các trường được phép gửi đi, mặc định cho mọi agent
+DEFAULT_CONTEXT_FIELDS = [
+    field.strip()
+    for field in os.getenv("AGENT_CONTEXT_FIELDS", "lang,user_info,token").split(",")
+    if field.strip()
+]
+# Chọn trường theo từng agent, ví dụ {"RagSchoolInfo": ["lang", "token"]}
+AGENT_CONTEXT_FIELDS: dict[str, list[str]] = json.loads(os.getenv("AGENT_CONTEXT_FIELDS_BY_AGENT", "{}") or "{}")
+# Các khoá của user_info được gửi đi, "*" để gửi toàn bộ
+USER_INFO_FIELDS = [
+    field.strip() for field in os.getenv("USER_INFO_FIELDS", "*").split(",") if field.strip()
+]
+ALLOWED_FIELDS = {"lang", "user_info", "token", "agent_use"}
+
+
+def _slim_user_info(user_info: Any) -> Any:
+    if not isinstance(user_info, dict) or "*" in USER_INFO_FIELDS:
+        return user_info
+    return {key: user_info[key] for key in USER_INFO_FIELDS if key in user_info}
+
+
+def build_context_envelope(agent_name: str, state: dict[str, Any]) -> dict[str, Any]:
+    """Builds the whitelisted, versioned metadata sent to `agent_name` instead of the whole session state."""
+    fields = AGENT_CONTEXT_FIELDS.get(agent_name, DEFAULT_CONTEXT_FIELDS)
+    envelope: dict[str, Any] = {"v": ENVELOPE_VERSION}
+    for field in fields:
+        if field not in ALLOWED_FIELDS:
+            continue
+        value = state.get(field)
+        if value is None:
+            continue
+        envelope[field] = _slim_user_info(value) if field == "user_info" else value
+    return envelope
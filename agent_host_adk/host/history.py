@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+from typing import Any, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest
+from google.genai import types
+
+# Giới hạn số token lịch sử gửi cho LLM của host
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+# Số lượt hỏi-đáp tối đa được giữ nguyên văn (ngoài lượt hiện tại)
+HISTORY_LENGTH = int(os.getenv("HISTORY_LENGTH", "5"))
+# Giới hạn số token của bản tóm tắt các lượt cũ
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "800"))
+# Số ký tự trung bình cho một token (ước lượng, tiếng Việt thường ~3)
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "3"))
+# Số ký tự tối đa lấy từ mỗi câu hỏi/câu trả lời khi tóm tắt
+SUMMARY_SNIPPET_CHARS = int(os.getenv("SUMMARY_SNIPPET_CHARS", "200"))
+
+SUMMARY_STATE_KEY = "history_summary"
+# Số khoá lượt đã tóm tắt được nhớ trong state (đủ phủ cửa sổ event nạp mỗi lượt)
+SUMMARY_KEYS_KEPT = int(os.getenv("SUMMARY_KEYS_KEPT", "100"))
+SUMMARY_HEADER = "Tóm tắt các lượt hội thoại trước đó (chỉ để tham khảo ngữ cảnh):"
+
+
+def count_tokens(content: types.Content) -> int:
+    """Estimates the number of tokens of a Content without calling the model."""
+    chars = 0
+    for part in content.parts or []:
+        if part.text:
+            chars += len(part.text)
+        elif part.function_call:
+            chars += len(part.function_call.name or "") + len(json.dumps(part.function_call.args or {}, ensure_ascii=False, default=str))
+        elif part.function_response:
+            chars += len(json.dumps(part.function_response.response or {}, ensure_ascii=False, default=str))
+        elif part.inline_data and part.inline_data.data:
+            chars += len(part.inline_data.data)
+    return int(chars / CHARS_PER_TOKEN) + 1
+
+
+def _is_user_turn(content: types.Content) -> bool:
+    return content.role == "user" and any(part.text for part in content.parts or [])
+
+
+def split_turns(contents: list[types.Content]) -> list[list[types.Content]]:
+    """Splits contents into turns, each starting at a user text message."""
+    turns: list[list[types.Content]] = []
+    for content in contents:
+        if _is_user_turn(content) or not turns:
+            turns.append([content])
+        else:
+            turns[-1].append(content)
+    return turns
+
+
+def _turn_key(turn: list[types.Content]) -> str:
+    text = "".join(part.text or "" for content in turn[:2] for part in content.parts or [])
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _snippet(text: str) -> str:
+    text = " ".join(text.split())
+    if len(text) > SUMMARY_SNIPPET_CHARS:
+        return text[:SUMMARY_SNIPPET_CHARS] + "…"
+    return text
+
+
+def summarize_turn(turn: list[types.Content]) -> str:
+    """Builds a one-line extractive summary of a turn: the question and the last text answer."""
+    question = " ".join(part.text for part in turn[0].parts or [] if part.text)
+    answer = ""
+    for content in reversed(turn[1:]):
+        if content.role == "model":
+            answer = " ".join(part.text for part in content.parts or [] if part.text)
+            if answer:
+                break
+    line = f"- Người dùng: {_snippet(question)}"
+    if answer:
+        line += f" | Trả lời: {_snippet(answer)}"
+    return line
+
+
+def _trim_summary(lines: list[str]) -> list[str]:
+    budget_chars = HISTORY_SUMMARY_TOKENS * CHARS_PER_TOKEN
+    total = sum(len(line) + 1 for line in lines)
+    while lines and total > budget_chars:
+        total -= len(lines[0]) + 1
+        lines = lines[1:]
+    return lines
+
+
+def _rolling_summary(
+    callback_context: CallbackContext, older: list[list[types.Content]]
+) -> Optional[str]:
+    """Returns the summary of `older` turns, extending the cached one in session state."""
+    if not older:
+        return None
+    cached: dict[str, Any] = callback_context.state.get(SUMMARY_STATE_KEY) or {}
+    keys = [_turn_key(turn) for turn in older]
+    lines = list(cached.get("lines") or [])
+    # Session chỉ nạp các event gần nhất nên lượt cũ nhất có thể đã trượt khỏi cửa sổ:
+    # nhớ các lượt đã tóm tắt thay vì chỉ lượt cuối để không phải tóm tắt lại từ đầu
+    summarized = list(cached.get("keys") or [])
+    new_turns = [turn for turn, key in zip(older, keys) if key not in summarized]
+    if new_turns:
+        lines = _trim_summary(lines + [summarize_turn(turn) for turn in new_turns])
+        summarized = (summarized + [key for key in keys if key not in summarized])[-SUMMARY_KEYS_KEPT:]
+        callback_context.state[SUMMARY_STATE_KEY] = {"keys": summarized, "lines": lines}
+    return "\n".join(lines) if lines else None
+
+
+def compact_history(callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+    """Keeps recent turns verbatim within HISTORY_TOKEN_BUDGET and replaces older ones with a summary."""
+    if not llm_request.contents:
+        return
+    turns = split_turns(llm_request.contents)
+    if not _is_user_turn(turns[0][0]):
+        # Nội dung trước câu hỏi đầu tiên của người dùng không thuộc lượt nào
+        turns = turns[1:]
+    if not turns:
+        return
+
+    kept: list[list[types.Content]] = []
+    used = 0
+    for turn in reversed(turns):
+        tokens = sum(count_tokens(content) for content in turn)
+        if kept and (used + tokens > HISTORY_TOKEN_BUDGET or len(kept) > HISTORY_LENGTH):
+            break
+        kept.insert(0, turn)
+        used += tokens
+
+    older = turns[: len(turns) - len(kept)]
+    contents = [content for turn in kept for content in turn]
+    summary = _rolling_summary(callback_context, older)
+    if summary:
+        contents.insert(
+            0, types.Content(role="user", parts=[types.Part(text=f"{SUMMARY_HEADER}\n{summary}")])
+        )
+    llm_request.contents = contents
@@ -0,0 +1,137 @@
+import asyncio
+import base64
+import hashlib
+import os
+import re
+import tempfile
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+IMAGE_DIR = os.getenv("IMAGE_DIR", "host/imgs")
+IMAGE_URL = os.getenv("IMAGE_URL", "http://localhost:9000/image/")
+# Giới hạn dung lượng thư mục ảnh và tuổi tối đa của ảnh (giây)
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_BYTES", str(500 * 1024 * 1024)))
+IMAGE_STORE_MAX_AGE = float(os.getenv("IMAGE_STORE_MAX_AGE", str(7 * 24 * 3600)))
+# Chu kỳ tối thiểu (giây) giữa hai lần dọn dẹp
+IMAGE_STORE_EVICT_INTERVAL = float(os.getenv("IMAGE_STORE_EVICT_INTERVAL", "300"))
+
+# Tham chiếu tới ảnh do agent ghi thẳng vào thư mục ảnh dùng chung (BLOB_DIR của agent = IMAGE_DIR của host)
+BLOB_URI_PREFIX = "blob://"
+
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_\-]+\.(png|jpe?g|gif|webp|svg)$")
+_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/svg+xml": "svg",
+}
+
+
+class ImageStore:
+    """Content-addressed image store: dedupes by SHA-256, writes off the event loop and evicts by size/age."""
+
+    def __init__(
+        self,
+        directory: str = IMAGE_DIR,
+        base_url: str = IMAGE_URL,
+        max_bytes: int = IMAGE_STORE_MAX_BYTES,
+        max_age: float = IMAGE_STORE_MAX_AGE,
+    ):
+        self.directory = directory
+        self.base_url = base_url
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._last_evict = 0.0
+        self._evict_task: Optional[asyncio.Task] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name: str) -> Optional[str]:
+        """Returns the file path for an image name, or None if the name is not a valid image name."""
+        if not _NAME_PATTERN.match(name):
+            return None
+        return os.path.join(self.directory, name)
+
+    def resolve_uri(self, uri: str) -> Optional[str]:
+        """Maps a blob:// reference to its public URL; other URIs are returned unchanged."""
+        if not uri.startswith(BLOB_URI_PREFIX):
+            return uri
+        name = uri[len(BLOB_URI_PREFIX):]
+        path = self.path(name)
+        if path is None or not os.path.exists(path):
+            print(f"Blob not found in image store: {uri}")
+            return None
+        return self.base_url + name
+
+    def _write(self, name: str, data: bytes) -> None:
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            # Ảnh đã có: chỉ cập nhật thời gian để không bị dọn theo tuổi
+            os.utime(path)
+            return
+        # Tên tạm riêng cho mỗi lần ghi: nhiều lần ghi cùng nội dung chạy song song không ghi đè file của nhau
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f".{name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if not os.path.exists(path):
+                raise
+            # Lần ghi khác cùng nội dung đã công bố file trước -> coi như thành công
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    async def put(self, data: bytes, mime_type: Optional[str] = "image/png") -> str:
+        """Stores image bytes and returns their public URL; identical content is stored once."""
+        name = f"{hashlib.sha256(data).hexdigest()}.{_EXTENSIONS.get(mime_type or '', 'png')}"
+        await asyncio.to_thread(self._write, name, data)
+        if time.monotonic() - self._last_evict >= IMAGE_STORE_EVICT_INTERVAL:
+            self._last_evict = time.monotonic()
+            self._evict_task = asyncio.create_task(self.evict())
+        return self.base_url + name
+
+    async def put_base64(self, data: str, mime_type: Optional[str] = "image/png") -> str:
+        image_bytes = await asyncio.to_thread(base64.b64decode, data)
+        return await self.put(image_bytes, mime_type)
+
+    def _evict(self) -> int:
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or not _NAME_PATTERN.match(entry.name):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    async def evict(self) -> int:
+        """Deletes images older than max_age, then the oldest ones until under max_bytes."""
+        try:
+            removed = await asyncio.to_thread(self._evict)
+            if removed:
+                print(f"Image store evicted {removed} file(s)")
+            return removed
+        except Exception as e:
+            print(f"Error evicting images: {e}")
+            return 0
+
+
+image_store = ImageStore()
@@ -1,22 +1,143 @@
-from typing import Callable
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Callable
 
-import httpx
 from a2a.client import A2AClient
 from a2a.types import (
     AgentCard,
     SendMessageRequest,
     SendMessageResponse,
+    SendStreamingMessageRequest,
     Task,
     TaskArtifactUpdateEvent,
     TaskStatusUpdateEvent,
 )
 from dotenv import load_dotenv
 
+from .transport import get_http_client, host_limiter
+
 load_dotenv()
 
 TaskCallbackArg = Task | TaskStatusUpdateEvent | TaskArtifactUpdateEvent
 TaskUpdateCallback = Callable[[TaskCallbackArg, AgentCard], Task]
 
+# Thời gian chờ tối đa (giây) cho một lần gọi agent, quá thời gian được tính là lỗi
+AGENT_TIMEOUT = float(os.getenv("AGENT_TIMEOUT", "120"))
+# Cấu hình circuit breaker cho từng agent
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_CONSECUTIVE_FAILURES = int(os.getenv("BREAKER_CONSECUTIVE_FAILURES", "3"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+# Hedged request: gửi thêm một request tới replica khác nếu chờ quá HEDGE_PERCENTILE độ trễ đã ghi nhận
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "1.0"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "5.0"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "10"))
+# Agent có tác dụng ghi (không idempotent): không hedge, không cache
+WRITE_AGENTS = {
+    name.strip() for name in os.getenv("WRITE_AGENTS", "AgentExecutor").split(",") if name.strip()
+}
+
+
+class AgentUnavailableError(Exception):
+    """Raised when the circuit breaker of a remote agent rejects a call."""
+
+    pass
+
+
+class AgentHealth:
+    """Rolling latency/error window and circuit breaker for one remote agent."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self):
+        # (thành công?, độ trễ giây) của BREAKER_WINDOW lần gọi gần nhất
+        self._calls: deque[tuple[bool, float]] = deque(maxlen=BREAKER_WINDOW)
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def is_available(self) -> bool:
+        """Returns True if allow_request() would currently let a call through, without side effects."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS
+        return not self._probe_in_flight
+
+    def allow_request(self) -> bool:
+        """Returns True if a call may be sent; moves OPEN to HALF_OPEN after the cool-down."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < BREAKER_OPEN_SECONDS:
+                return False
+            self.state = self.HALF_OPEN
+        # HALF_OPEN: chỉ cho một request thăm dò đi qua
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self, latency: float) -> None:
+        self._calls.append((True, latency))
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+        self.state = self.CLOSED
+
+    def record_abandoned(self) -> None:
+        """Releases the half-open probe slot for a call cancelled by the caller."""
+        self._probe_in_flight = False
+
+    def record_failure(self, latency: float) -> None:
+        self._calls.append((False, latency))
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self._should_open():
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def _should_open(self) -> bool:
+        if self.consecutive_failures >= BREAKER_CONSECUTIVE_FAILURES:
+            return True
+        return len(self._calls) >= BREAKER_MIN_CALLS and self.error_rate() >= BREAKER_FAILURE_RATE
+
+    def error_rate(self) -> float:
+        if not self._calls:
+            return 0.0
+        return sum(1 for ok, _ in self._calls if not ok) / len(self._calls)
+
+    def latencies(self) -> list[float]:
+        """Returns the latencies of successful calls in the window."""
+        return [latency for ok, latency in self._calls if ok]
+
+    def latency_percentile(self, percentile: float) -> float | None:
+        """Returns the given latency percentile (0-100) of successful calls in the window."""
+        latencies = sorted(self.latencies())
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(round(percentile / 100 * (len(latencies) - 1))))
+        return latencies[index]
+
+    def snapshot(self) -> dict[str, Any]:
+        p50 = self.latency_percentile(50)
+        p95 = self.latency_percentile(95)
+        return {
+            "state": self.state,
+            "calls": len(self._calls),
+            "error_rate": round(self.error_rate(), 3),
+            "p50_ms": None if p50 is None else round(p50 * 1000),
+            "p95_ms": None if p95 is None else round(p95 * 1000),
+        }
+
 
 class RemoteAgentConnections:
     """A class to hold the connections to the remote agents."""
@@ -24,9 +145,14 @@ class RemoteAgentConnections:
     def __init__(self, agent_card: AgentCard, agent_url: str):
         print(f"agent_card: {agent_card}")
         print(f"agent_url: {agent_url}")
-        self._httpx_client = httpx.AsyncClient(timeout=300)
+        self._httpx_client = get_http_client()
         self.agent_client = A2AClient(self._httpx_client, agent_card, url=agent_url)
+        self._limiter = host_limiter(agent_url)
+        self.health = AgentHealth()
+        # Số request đang chờ phản hồi, dùng cho cân bằng tải giữa các replica
+        self.outstanding = 0
         self.card = agent_card
+        self.agent_url = agent_url
         self.conversation_name = None
         self.conversation = None
         self.pending_tasks = set()
@@ -37,9 +163,155 @@ class RemoteAgentConnections:
     async def send_message(
         self, message_request: SendMessageRequest
     ) -> SendMessageResponse:
-        return await self.agent_client.send_message(message_request)
+        if not self.health.allow_request():
+            raise AgentUnavailableError(f"Agent {self.card.name} is temporarily unavailable")
+        started = time.monotonic()
+        self.outstanding += 1
+        try:
+            async with self._limiter:
+                response = await asyncio.wait_for(
+                    self.agent_client.send_message(message_request), timeout=AGENT_TIMEOUT
+                )
+        except asyncio.CancelledError:
+            self.health.record_abandoned()
+            raise
+        except Exception:
+            self.health.record_failure(time.monotonic() - started)
+            raise
+        finally:
+            self.outstanding -= 1
+        self.health.record_success(time.monotonic() - started)
+        return response
+
     async def send_message_stream(
+        self, message_request: SendStreamingMessageRequest
+    ):
+        if not self.health.allow_request():
+            raise AgentUnavailableError(f"Agent {self.card.name} is temporarily unavailable")
+        started = time.monotonic()
+        self.outstanding += 1
+        try:
+            async with self._limiter:
+                # Cả stream có chung hạn AGENT_TIMEOUT như send_message, không chờ read timeout của transport
+                deadline = started + AGENT_TIMEOUT
+                stream = self.agent_client.send_message_streaming(message_request)
+                try:
+                    while True:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError()
+                        try:
+                            chunk = await asyncio.wait_for(stream.__anext__(), timeout=remaining)
+                        except StopAsyncIteration:
+                            break
+                        yield chunk
+                finally:
+                    await stream.aclose()
+        except (asyncio.CancelledError, GeneratorExit):
+            self.health.record_abandoned()
+            raise
+        except Exception:
+            self.health.record_failure(time.monotonic() - started)
+            raise
+        finally:
+            self.outstanding -= 1
+        self.health.record_success(time.monotonic() - started)
+
+
+class AgentReplicaSet:
+    """All replicas serving one logical agent name, balanced by power-of-two-choices."""
+
+    def __init__(self, name: str, replicas: list[RemoteAgentConnections]):
+        self.name = name
+        self.replicas = replicas
+
+    def get_agent(self) -> AgentCard:
+        return self.replicas[0].card
+
+    @property
+    def card(self) -> AgentCard:
+        return self.get_agent()
+
+    @property
+    def state(self) -> str:
+        """CLOSED if any replica is closed, OPEN if all are open, otherwise HALF_OPEN."""
+        states = {replica.health.state for replica in self.replicas}
+        if AgentHealth.CLOSED in states:
+            return AgentHealth.CLOSED
+        if states == {AgentHealth.OPEN}:
+            return AgentHealth.OPEN
+        return AgentHealth.HALF_OPEN
+
+    def pick(self, exclude: RemoteAgentConnections | None = None) -> RemoteAgentConnections:
+        """Picks the less loaded of two random available replicas."""
+        available = [
+            replica
+            for replica in self.replicas
+            if replica is not exclude and replica.health.is_available()
+        ]
+        if not available:
+            raise AgentUnavailableError(f"Agent {self.name} is temporarily unavailable")
+        if len(available) <= 2:
+            return min(available, key=lambda replica: replica.outstanding)
+        first, second = random.sample(available, 2)
+        return first if first.outstanding <= second.outstanding else second
+
+    @property
+    def hedgeable(self) -> bool:
+        return HEDGE_ENABLED and self.name not in WRITE_AGENTS and len(self.replicas) > 1
+
+    def hedge_delay(self) -> float:
+        """Returns the delay before hedging: the configured latency percentile seen so far."""
+        latencies = sorted(
+            latency for replica in self.replicas for latency in replica.health.latencies()
+        )
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        index = min(len(latencies) - 1, int(round(HEDGE_PERCENTILE / 100 * (len(latencies) - 1))))
+        return max(HEDGE_MIN_DELAY, latencies[index])
+
+    async def send_message(
         self, message_request: SendMessageRequest
+    ) -> SendMessageResponse:
+        primary = self.pick()
+        if not self.hedgeable:
+            return await primary.send_message(message_request)
+
+        tasks = [asyncio.create_task(primary.send_message(message_request))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay())
+            if not done:
+                try:
+                    secondary = self.pick(exclude=primary)
+                    tasks.append(asyncio.create_task(secondary.send_message(message_request)))
+                except AgentUnavailableError:
+                    pass
+            # Lấy kết quả thành công đầu tiên, bỏ qua request lỗi nếu request kia còn đang chạy
+            pending = set(tasks)
+            error: BaseException | None = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def send_message_stream(
+        self, message_request: SendStreamingMessageRequest
     ):
-        async for chunk in self.agent_client.send_message_streaming(message_request):
+        async for chunk in self.pick().send_message_stream(message_request):
             yield chunk
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "state": self.state,
+            "replicas": {
+                replica.agent_url: {**replica.health.snapshot(), "outstanding": replica.outstanding}
+                for replica in self.replicas
+            },
+        }
@@ -0,0 +1,116 @@
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Optional
+
+from a2a.types import AgentCard
+from google import genai
+
+# Bộ định tuyến nhanh: gửi thẳng câu hỏi tới agent khi đủ tự tin, bỏ qua một lượt gọi LLM
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "true").lower() == "true"
+ROUTER_MIN_SCORE = float(os.getenv("ROUTER_MIN_SCORE", "0.5"))
+ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.15"))
+ROUTER_MIN_QUERY_TOKENS = int(os.getenv("ROUTER_MIN_QUERY_TOKENS", "3"))
+# Để trống để chỉ dùng từ khoá; ví dụ "text-embedding-004" để kết hợp thêm embedding
+ROUTER_EMBEDDING_MODEL = os.getenv("ROUTER_EMBEDDING_MODEL", "")
+ROUTER_EMBEDDING_WEIGHT = float(os.getenv("ROUTER_EMBEDDING_WEIGHT", "0.5"))
+
+
+def tokenize(text: str) -> list[str]:
+    """Lower-cased word unigrams and bigrams (Vietnamese words are often two syllables)."""
+    words = re.findall(r"\w+", unicodedata.normalize("NFC", text or "").lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def _cosine(a: dict[str, float], b: dict[str, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(weight * b.get(term, 0.0) for term, weight in a.items())
+    norm = math.sqrt(sum(w * w for w in a.values())) * math.sqrt(sum(w * w for w in b.values()))
+    return dot / norm if norm else 0.0
+
+
+def _dense_cosine(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class FastPathRouter:
+    """Keyword (TF-IDF) and optional embedding classifier trained from agent-card skills."""
+
+    def __init__(self):
+        # (tên agent, vector tf-idf) cho mỗi ví dụ / nhóm tag của từng skill
+        self._docs: list[tuple[str, dict[str, float]]] = []
+        self._idf: dict[str, float] = {}
+        self._embeddings: list[tuple[str, list[float]]] = []
+        self._client: Optional[genai.Client] = None
+
+    def _vectorize(self, tokens: list[str]) -> dict[str, float]:
+        counts = Counter(tokens)
+        return {term: count * self._idf[term] for term, count in counts.items() if term in self._idf}
+
+    async def fit(self, cards: dict[str, AgentCard]) -> None:
+        """Builds the classifier from the skill examples and tags of each agent card."""
+        texts: list[tuple[str, str]] = []
+        for name, card in cards.items():
+            for skill in card.skills:
+                texts.extend((name, example) for example in skill.examples or [])
+                if skill.tags:
+                    texts.append((name, " ".join(skill.tags)))
+        tokenized = [(name, tokenize(text)) for name, text in texts]
+        df = Counter(term for _, tokens in tokenized for term in set(tokens))
+        total = len(tokenized)
+        self._idf = {term: math.log((1 + total) / (1 + count)) + 1 for term, count in df.items()}
+        self._docs = [(name, self._vectorize(tokens)) for name, tokens in tokenized]
+        self._embeddings = []
+        if ROUTER_EMBEDDING_MODEL and texts:
+            vectors = await self._embed([text for _, text in texts])
+            if vectors:
+                self._embeddings = [(name, vector) for (name, _), vector in zip(texts, vectors)]
+
+    async def _embed(self, texts: list[str]) -> Optional[list[list[float]]]:
+        try:
+            if self._client is None:
+                self._client = genai.Client()
+            response = await self._client.aio.models.embed_content(
+                model=ROUTER_EMBEDDING_MODEL, contents=texts
+            )
+            return [embedding.values for embedding in response.embeddings]
+        except Exception as e:
+            print(f"WARNING: Router embedding failed, using keywords only: {e}")
+            return None
+
+    async def route(self, query: str) -> Optional[tuple[str, float]]:
+        """Returns (agent name, score) when one agent clearly matches the query, otherwise None."""
+        if not ROUTER_ENABLED or not self._docs:
+            return None
+        tokens = tokenize(query)
+        if len([token for token in tokens if " " not in token]) < ROUTER_MIN_QUERY_TOKENS:
+            return None
+        query_vector = self._vectorize(tokens)
+        scores: dict[str, float] = {}
+        for name, vector in self._docs:
+            scores[name] = max(scores.get(name, 0.0), _cosine(query_vector, vector))
+
+        if self._embeddings:
+            vectors = await self._embed([query])
+            if vectors:
+                embedding_scores: dict[str, float] = {}
+                for name, vector in self._embeddings:
+                    similarity = _dense_cosine(vectors[0], vector)
+                    embedding_scores[name] = max(embedding_scores.get(name, 0.0), similarity)
+                scores = {
+                    name: (1 - ROUTER_EMBEDDING_WEIGHT) * score
+                    + ROUTER_EMBEDDING_WEIGHT * embedding_scores.get(name, 0.0)
+                    for name, score in scores.items()
+                }
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        best_name, best_score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        if best_score >= ROUTER_MIN_SCORE and best_score - runner_up >= ROUTER_MIN_MARGIN:
+            return best_name, best_score
+        return None
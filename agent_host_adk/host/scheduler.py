@@ -0,0 +1,214 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Iterator, Optional
+
+# Trọng số chia sẻ theo user_type: loại có trọng số cao được phục vụ nhiều hơn khi có tranh chấp
+SCHEDULER_WEIGHTS: dict[str, float] = json.loads(
+    os.getenv("SCHEDULER_WEIGHTS", "")
+    or '{"Học sinh": 4, "Giáo viên": 2, "Cán bộ quản lý": 1}'
+)
+SCHEDULER_DEFAULT_WEIGHT = float(os.getenv("SCHEDULER_DEFAULT_WEIGHT", "1"))
+# Số lần gọi LLM của host chạy đồng thời
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Lease LLM tự trả sau số giây này (phòng khi after_model_callback không được gọi vì lỗi model)
+LLM_LEASE_TIMEOUT = float(os.getenv("LLM_LEASE_TIMEOUT", "120"))
+# Thời gian chờ tối đa (giây) để có slot LLM, quá thời gian thì trả lời "quá tải" thay vì treo request
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Số mẫu thời gian chờ giữ lại cho mỗi loại để tính p50/p95
+SCHEDULER_METRICS_WINDOW = int(os.getenv("SCHEDULER_METRICS_WINDOW", "500"))
+
+DEFAULT_FLOW = "default"
+
+
+def flow_weight(flow: str) -> float:
+    return max(float(SCHEDULER_WEIGHTS.get(flow, SCHEDULER_DEFAULT_WEIGHT)), 1e-6)
+
+
+class _Flow:
+    """Per-flow finish tag and queue-time samples."""
+
+    def __init__(self):
+        self.finish = 0.0
+        self.queued = 0
+        self.served = 0
+        self.waits: deque[float] = deque(maxlen=SCHEDULER_METRICS_WINDOW)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if not self.waits:
+            return None
+        ordered = sorted(self.waits)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+
+class FairScheduler:
+    """
+    Weighted fair queuing in front of a pool of `capacity` concurrent slots.
+
+    Each request belongs to a flow (the user's user_type) and gets a virtual
+    finish tag max(virtual_time, flow.finish) + cost / weight; when a slot frees
+    up the waiter with the smallest tag is served. A flow with weight 4 thus gets
+    four slots for every one of a weight-1 flow while both are backlogged, and
+    an idle flow does not bank credit for later.
+    """
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = capacity
+        self.in_use = 0
+        self.virtual_time = 0.0
+        self._flows: dict[str, _Flow] = {}
+        self._heap: list[tuple[float, int, asyncio.Future, str, float]] = []
+        self._order = itertools.count()
+
+    def _flow(self, flow: str) -> _Flow:
+        state = self._flows.get(flow)
+        if state is None:
+            state = self._flows[flow] = _Flow()
+        return state
+
+    def _tag(self, flow: str, cost: float) -> float:
+        state = self._flow(flow)
+        start = max(self.virtual_time, state.finish)
+        state.finish = start + cost / flow_weight(flow)
+        return state.finish
+
+    def _record(self, flow: str, wait: float) -> None:
+        state = self._flow(flow)
+        state.served += 1
+        state.waits.append(wait)
+
+    async def acquire(self, flow: str = DEFAULT_FLOW, cost: float = 1.0) -> None:
+        """Waits for a slot in fair order; the caller must call release() exactly once afterwards."""
+        flow = flow or DEFAULT_FLOW
+        tag = self._tag(flow, cost)
+        if self.in_use < self.capacity and not self._heap:
+            self.in_use += 1
+            self.virtual_time = tag
+            self._record(flow, 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (tag, next(self._order), future, flow, time.monotonic()))
+        self._flow(flow).queued += 1
+        # Hàng đợi có thể chỉ còn waiter đã huỷ (timeout) trong khi vẫn còn slot trống
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Đã được cấp slot đúng lúc bị huỷ -> trả lại cho người kế tiếp
+                self.release()
+            raise
+        finally:
+            self._flow(flow).queued -= 1
+
+    @property
+    def queued(self) -> int:
+        """Number of requests currently waiting for a slot (cancelled waiters excluded)."""
+        return sum(state.queued for state in self._flows.values())
+
+    def release(self) -> None:
+        self.in_use -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._heap and self.in_use < self.capacity:
+            tag, _, future, flow, enqueued = heapq.heappop(self._heap)
+            if future.done():
+                continue
+            self.in_use += 1
+            self.virtual_time = tag
+            self._record(flow, time.monotonic() - enqueued)
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, flow: str = DEFAULT_FLOW, cost: float = 1.0) -> AsyncIterator[None]:
+        await self.acquire(flow, cost)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "queued": self.queued,
+            "flows": {
+                flow: {
+                    "weight": flow_weight(flow),
+                    "queued": state.queued,
+                    "served": state.served,
+                    "wait_p50": state.percentile(50),
+                    "wait_p95": state.percentile(95),
+                }
+                for flow, state in self._flows.items()
+            },
+        }
+
+
+class LeaseTable:
+    """
+    Holds scheduler slots across callbacks: acquired in before_model_callback,
+    released in after_model_callback, keyed by invocation id.
+
+    A lease left over (the model call raised or the run was cancelled, so
+    after_model_callback never ran) is released when the run_scope() around
+    runner.run_async exits; the LLM_LEASE_TIMEOUT timer is only a last resort.
+    """
+
+    def __init__(
+        self,
+        scheduler: FairScheduler,
+        timeout: float = LLM_LEASE_TIMEOUT,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+    ):
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._leases: dict[str, asyncio.TimerHandle] = {}
+        # Các lease được lấy trong lượt chạy hiện tại (run_scope), để trả lại khi lượt kết thúc
+        self._run_keys: ContextVar[Optional[set[str]]] = ContextVar("llm_run_leases", default=None)
+
+    async def acquire(self, key: str, flow: str) -> None:
+        """Takes a slot for `key`; raises asyncio.TimeoutError after `queue_timeout` seconds."""
+        self.release(key)
+        await asyncio.wait_for(self.scheduler.acquire(flow), timeout=self.queue_timeout)
+        self._leases[key] = asyncio.get_running_loop().call_later(self.timeout, self.release, key)
+        run_keys = self._run_keys.get()
+        if run_keys is not None:
+            run_keys.add(key)
+
+    @contextmanager
+    def run_scope(self) -> Iterator[None]:
+        """Releases every lease acquired inside the block when it exits, including on error or cancel."""
+        run_keys: set[str] = set()
+        token = self._run_keys.set(run_keys)
+        try:
+            yield
+        finally:
+            try:
+                self._run_keys.reset(token)
+            except ValueError:
+                # Thoát từ context khác (async generator bị đóng từ task khác)
+                self._run_keys.set(None)
+            for key in run_keys:
+                self.release(key)
+
+    def release(self, key: str) -> None:
+        timer = self._leases.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+            self.scheduler.release()
+
+
+llm_scheduler = FairScheduler("llm", LLM_MAX_CONCURRENCY)
+llm_leases = LeaseTable(llm_scheduler)
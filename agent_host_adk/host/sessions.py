@@ -0,0 +1,313 @@
+import asyncio
+import os
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, DatabaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig
+from google.adk.sessions.database_session_service import (
+    StorageAppState,
+    StorageEvent,
+    StorageSession,
+    StorageUserState,
+    _extract_state_delta,
+)
+from sqlalchemy import Column, Index, MetaData, Table, func, insert, select
+
+from .history import HISTORY_LENGTH
+
+# Số event gần nhất được nạp mỗi lượt (0 để nạp toàn bộ); các lượt cũ hơn đã nằm trong history_summary
+SESSION_LOAD_EVENTS = int(os.getenv("SESSION_LOAD_EVENTS", "100"))
+# Chu kỳ (giây) chạy job dọn session, 0 để tắt
+SESSION_COMPACT_INTERVAL = float(os.getenv("SESSION_COMPACT_INTERVAL", "3600"))
+# Số lượt hỏi-đáp gần nhất được giữ trong bảng events, các event cũ hơn được lưu trữ/xoá
+SESSION_KEEP_TURNS = int(os.getenv("SESSION_KEEP_TURNS", "20"))
+# true -> chép event cũ sang bảng events_archive trước khi xoá
+SESSION_ARCHIVE = os.getenv("SESSION_ARCHIVE", "true").lower() == "true"
+# Xoá session không hoạt động quá số giây này, 0 để giữ mãi
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", str(30 * 24 * 3600)))
+# true -> gom các event của một lượt và ghi xuống DB trong một transaction khi lượt kết thúc
+SESSION_COALESCE_WRITES = os.getenv("SESSION_COALESCE_WRITES", "true").lower() == "true"
+
+ARCHIVE_TABLE = "events_archive"
+
+# Session được giữ sẵn trong context hiện tại (ví dụ suốt một kết nối WebSocket); get_session trả lại
+# đúng object này thay vì nạp lại events từ DB mỗi tin nhắn
+bound_session: ContextVar[Optional[Session]] = ContextVar("bound_session", default=None)
+
+# get_session lọc theo (app_name, user_id, session_id) rồi sắp theo timestamp, khoá chính của events bắt đầu bằng id nên không dùng được
+EVENTS_SESSION_INDEX = Index(
+    "ix_events_session_timestamp",
+    StorageEvent.app_name,
+    StorageEvent.user_id,
+    StorageEvent.session_id,
+    StorageEvent.timestamp,
+)
+SESSIONS_UPDATE_INDEX = Index("ix_sessions_update_time", StorageSession.update_time)
+# Cùng cột với events nhưng không có khoá chính/khoá ngoại, chỉ để lưu trữ
+EVENTS_ARCHIVE = Table(
+    ARCHIVE_TABLE,
+    MetaData(),
+    *[Column(column.name, column.type) for column in StorageEvent.__table__.columns],
+)
+
+
+class BoundedSessionService(DatabaseSessionService):
+    """
+    DatabaseSessionService with a bounded per-turn load and a retention job.
+
+    get_session only loads the most recent SESSION_LOAD_EVENTS events (older turns
+    are already folded into the rolling history summary), and a background job
+    archives events older than SESSION_KEEP_TURNS turns and deletes idle sessions.
+
+    With SESSION_COALESCE_WRITES, events of an invocation are applied to the
+    in-memory session right away but written to the database in one transaction
+    when the invocation produces its final response (or on flush()), with the
+    merged state delta minus keys whose value did not change.
+    """
+
+    def __init__(self, db_url: str, **kwargs: Any):
+        super().__init__(db_url=db_url, **kwargs)
+        # Giữ ít nhất số lượt mà compact_history còn gửi nguyên văn cho LLM
+        self.keep_turns = max(SESSION_KEEP_TURNS, HISTORY_LENGTH + 2)
+        self._compact_task: Optional[asyncio.Task] = None
+        self._last_run: dict[str, Any] = {}
+        self._pending: dict[tuple[str, str, str], tuple[Session, list[Event]]] = {}
+        # Số transaction ghi event, dùng cho health/benchmark
+        self.writes = 0
+        self._ensure_indexes()
+
+    def _ensure_indexes(self) -> None:
+        if SESSION_ARCHIVE:
+            EVENTS_ARCHIVE.create(self.db_engine, checkfirst=True)
+        for index in (EVENTS_SESSION_INDEX, SESSIONS_UPDATE_INDEX):
+            try:
+                index.create(self.db_engine, checkfirst=True)
+            except Exception as e:
+                print(f"Could not create index {index.name}: {e}")
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        bound = bound_session.get()
+        if config is None and bound is not None and (bound.app_name, bound.user_id, bound.id) == (
+            app_name, user_id, session_id
+        ):
+            return await self._refresh_bound(bound)
+        if config is None and SESSION_LOAD_EVENTS > 0:
+            config = GetSessionConfig(num_recent_events=SESSION_LOAD_EVENTS)
+        return await super().get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id, config=config
+        )
+
+    async def _refresh_bound(self, session: Session) -> Optional[Session]:
+        """
+        Returns the bound session after a single-row freshness check, reloading it in
+        place only when another request wrote to it since it was loaded.
+        """
+        if (session.app_name, session.user_id, session.id) not in self._pending:
+            with self.database_session_factory() as db:
+                storage_session = db.get(StorageSession, (session.app_name, session.user_id, session.id))
+                if storage_session is None:
+                    return None
+                # update_time trên SQLite chỉ chính xác tới giây, nên so thêm event mới nhất (dùng ix_events_session_timestamp)
+                newest = db.execute(
+                    select(func.max(StorageEvent.timestamp)).where(
+                        StorageEvent.app_name == session.app_name,
+                        StorageEvent.user_id == session.user_id,
+                        StorageEvent.session_id == session.id,
+                    )
+                ).scalar()
+                stale = storage_session.update_timestamp_tz > session.last_update_time or (
+                    newest is not None
+                    and (not session.events or newest > datetime.fromtimestamp(session.events[-1].timestamp))
+                )
+            if stale:
+                fresh = await super().get_session(
+                    app_name=session.app_name,
+                    user_id=session.user_id,
+                    session_id=session.id,
+                    config=GetSessionConfig(num_recent_events=SESSION_LOAD_EVENTS) if SESSION_LOAD_EVENTS > 0 else None,
+                )
+                if fresh is None:
+                    return None
+                # Cập nhật ngay trên object cũ để mọi nơi đang giữ nó đều thấy bản mới
+                session.state = fresh.state
+                session.events = fresh.events
+                session.last_update_time = fresh.last_update_time
+        if SESSION_LOAD_EVENTS > 0:
+            # Session sống lâu vẫn chỉ giữ số event như một lần nạp
+            del session.events[:-SESSION_LOAD_EVENTS]
+        return session
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        if not SESSION_COALESCE_WRITES:
+            self.writes += 1
+            return await super().append_event(session=session, event=event)
+
+        key = (session.app_name, session.user_id, session.id)
+        pending = self._pending.get(key)
+        if pending is not None and (pending[0] is not session or pending[1][-1].invocation_id != event.invocation_id):
+            # Lượt khác (hoặc session được nạp lại) -> ghi phần còn treo trước
+            self._commit(*self._pending.pop(key))
+        self._pending.setdefault(key, (session, []))[1].append(event)
+        # Chỉ cập nhật session trong bộ nhớ, bỏ qua phần ghi DB của DatabaseSessionService
+        await BaseSessionService.append_event(self, session=session, event=event)
+        if event.author != "user" and event.is_final_response():
+            await self.flush(session.app_name, session.user_id, session.id)
+        return event
+
+    async def flush(self, app_name: str, user_id: str, session_id: str) -> None:
+        """Writes the buffered events of a session, if any, in a single transaction."""
+        pending = self._pending.pop((app_name, user_id, session_id), None)
+        if pending is not None:
+            self._commit(*pending)
+
+    def _commit(self, session: Session, events: list[Event]) -> None:
+        app_delta: dict[str, Any] = {}
+        user_delta: dict[str, Any] = {}
+        session_delta: dict[str, Any] = {}
+        for event in events:
+            if event.actions and event.actions.state_delta:
+                app, user, own = _extract_state_delta(event.actions.state_delta)
+                app_delta.update(app)
+                user_delta.update(user)
+                session_delta.update(own)
+
+        with self.database_session_factory() as db:
+            storage_session = db.get(StorageSession, (session.app_name, session.user_id, session.id))
+            if storage_session is None:
+                raise ValueError(f"Session {session.id} not found.")
+            if storage_session.update_timestamp_tz > session.last_update_time:
+                raise ValueError(
+                    f"Session {session.id} was modified in storage after it was loaded;"
+                    " reload the session before appending events."
+                )
+            if app_delta:
+                storage_app_state = db.get(StorageAppState, (session.app_name))
+                storage_app_state.state = {**storage_app_state.state, **app_delta}
+            if user_delta:
+                storage_user_state = db.get(StorageUserState, (session.app_name, session.user_id))
+                storage_user_state.state = {**storage_user_state.state, **user_delta}
+            # Ví dụ token được gửi lại mỗi lượt: không ghi lại state nếu giá trị không đổi
+            session_delta = {k: v for k, v in session_delta.items() if storage_session.state.get(k) != v}
+            if session_delta:
+                storage_session.state = {**storage_session.state, **session_delta}
+            # Luôn đẩy update_time như đường ghi từng event của ADK: kiểm tra bản mới (WebSocket) và job dọn session dựa vào nó
+            storage_session.update_time = func.now()
+            db.add_all([StorageEvent.from_event(session, event) for event in events])
+            db.commit()
+            db.refresh(storage_session)
+            session.last_update_time = storage_session.update_timestamp_tz
+        self.writes += 1
+
+    def start(self) -> None:
+        if SESSION_COMPACT_INTERVAL > 0 and self._compact_task is None:
+            self._compact_task = asyncio.create_task(self._compact_loop())
+
+    async def stop(self) -> None:
+        if self._compact_task is not None:
+            self._compact_task.cancel()
+            await asyncio.gather(self._compact_task, return_exceptions=True)
+            self._compact_task = None
+
+    async def _compact_loop(self) -> None:
+        while True:
+            try:
+                await self.compact()
+            except Exception as e:
+                print(f"Session compaction failed: {e}")
+            await asyncio.sleep(SESSION_COMPACT_INTERVAL)
+
+    async def compact(self) -> dict[str, Any]:
+        """Runs one retention pass; the queries are blocking so they run in a worker thread."""
+        result = await asyncio.to_thread(self._compact_sync)
+        self._last_run = {**result, "finished_at": datetime.now().isoformat()}
+        print(f"Session compaction: {result}")
+        return result
+
+    def _compact_sync(self) -> dict[str, Any]:
+        expired = self._delete_idle_sessions() if SESSION_IDLE_TTL > 0 else 0
+        archived = self._trim_old_events()
+        return {"deleted_sessions": expired, "archived_events": archived}
+
+    def _delete_idle_sessions(self) -> int:
+        cutoff = datetime.now() - timedelta(seconds=SESSION_IDLE_TTL)
+        if self.db_engine.dialect.name == "sqlite":
+            # ADK lưu update_time trên SQLite theo UTC, không kèm múi giờ
+            cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=SESSION_IDLE_TTL)
+        with self.database_session_factory() as db:
+            idle = db.execute(
+                select(StorageSession.app_name, StorageSession.user_id, StorageSession.id)
+                .where(StorageSession.update_time < cutoff)
+            ).all()
+            for app_name, user_id, session_id in idle:
+                # Không dựa vào ON DELETE CASCADE (SQLite không bật khoá ngoại mặc định)
+                db.query(StorageEvent).filter(
+                    StorageEvent.app_name == app_name,
+                    StorageEvent.user_id == user_id,
+                    StorageEvent.session_id == session_id,
+                ).delete(synchronize_session=False)
+                db.query(StorageSession).filter(
+                    StorageSession.app_name == app_name,
+                    StorageSession.user_id == user_id,
+                    StorageSession.id == session_id,
+                ).delete(synchronize_session=False)
+            db.commit()
+        return len(idle)
+
+    def _trim_old_events(self) -> int:
+        is_user_turn = StorageEvent.author == "user"
+        archived = 0
+        with self.database_session_factory() as db:
+            long_sessions = db.execute(
+                select(StorageEvent.app_name, StorageEvent.user_id, StorageEvent.session_id)
+                .where(is_user_turn)
+                .group_by(StorageEvent.app_name, StorageEvent.user_id, StorageEvent.session_id)
+                .having(func.count() > self.keep_turns)
+            ).all()
+            for app_name, user_id, session_id in long_sessions:
+                in_session = (
+                    StorageEvent.app_name == app_name,
+                    StorageEvent.user_id == user_id,
+                    StorageEvent.session_id == session_id,
+                )
+                # Mốc thời gian của câu hỏi thứ keep_turns tính từ cuối
+                cutoff = db.execute(
+                    select(StorageEvent.timestamp)
+                    .where(*in_session, is_user_turn)
+                    .order_by(StorageEvent.timestamp.desc())
+                    .offset(self.keep_turns - 1)
+                    .limit(1)
+                ).scalar()
+                if cutoff is None:
+                    continue
+                old = (*in_session, StorageEvent.timestamp < cutoff)
+                if SESSION_ARCHIVE:
+                    db.execute(insert(EVENTS_ARCHIVE).from_select(
+                        [c.name for c in StorageEvent.__table__.columns],
+                        select(StorageEvent.__table__).where(*old),
+                    ))
+                archived += db.query(StorageEvent).filter(*old).delete(synchronize_session=False)
+                db.commit()
+        return archived
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "load_events": SESSION_LOAD_EVENTS,
+            "keep_turns": self.keep_turns,
+            "idle_ttl": SESSION_IDLE_TTL,
+            "coalesce_writes": SESSION_COALESCE_WRITES,
+            "event_writes": self.writes,
+            "pending_sessions": len(self._pending),
+            "last_compaction": self._last_run or None,
+        }
@@ -0,0 +1,40 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single upstream call."""
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Runs `fn()` unless a call with the same key is already in flight, then awaits its result.
+
+        The shared call is shielded, so a cancelled caller does not cancel it for the others.
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(fn())
+        self._inflight[key] = future
+        self.calls += 1
+
+        def _forget(done: asyncio.Future) -> None:
+            if self._inflight.get(key) is done:
+                del self._inflight[key]
+            if not done.cancelled():
+                # Tránh cảnh báo "exception was never retrieved" khi mọi caller đã huỷ
+                done.exception()
+
+        future.add_done_callback(_forget)
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict[str, Any]:
+        return {"in_flight": len(self._inflight), "calls": self.calls, "coalesced": self.coalesced}
@@ -0,0 +1,177 @@
+import asyncio
+import ipaddress
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Optional
+from urllib.parse import urlsplit
+
+from .transport import build_timeout, get_http_client
+
+# Số worker chạy nền xử lý /api/message/async và số task tối đa được xếp hàng
+TASK_WORKERS = int(os.getenv("TASK_WORKERS", "8"))
+TASK_QUEUE_SIZE = int(os.getenv("TASK_QUEUE_SIZE", "200"))
+# Thời gian (giây) giữ kết quả task đã xong để client poll
+TASK_RESULT_TTL = float(os.getenv("TASK_RESULT_TTL", "900"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+WEBHOOK_RETRIES = int(os.getenv("WEBHOOK_RETRIES", "3"))
+# Tiền tố URL webhook được phép (phân tách bằng dấu phẩy); để trống thì chỉ cho phép host có địa chỉ IP công khai
+WEBHOOK_ALLOWED_PREFIXES = [
+    prefix.strip() for prefix in os.getenv("WEBHOOK_ALLOWED_PREFIXES", "").split(",") if prefix.strip()
+]
+
+
+async def _is_public_host(host: str, port: int) -> bool:
+    """True if every address `host` resolves to is a public (global) IP."""
+    try:
+        addresses = [ipaddress.ip_address(host)]
+    except ValueError:
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port)
+        except OSError:
+            return False
+        addresses = [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+    return bool(addresses) and all(address.is_global for address in addresses)
+
+
+async def webhook_allowed(url: str) -> bool:
+    """
+    Checks a webhook URL against WEBHOOK_ALLOWED_PREFIXES, or, when no prefix is
+    configured, rejects loopback, private, link-local (cloud metadata) and other
+    non-public addresses so the host cannot be used to reach internal services.
+    """
+    parsed = urlsplit(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return False
+    if WEBHOOK_ALLOWED_PREFIXES:
+        return url.startswith(tuple(WEBHOOK_ALLOWED_PREFIXES))
+    return await _is_public_host(parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80))
+
+
+class TaskQueueFullError(Exception):
+    """Raised when the background task queue has no free slot."""
+
+    pass
+
+
+class TaskManager:
+    """Runs submitted jobs in a bounded background worker pool and keeps their results for polling."""
+
+    def __init__(
+        self,
+        workers: int = TASK_WORKERS,
+        queue_size: int = TASK_QUEUE_SIZE,
+        result_ttl: float = TASK_RESULT_TTL,
+    ):
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks: dict[str, dict[str, Any]] = {}
+        self._jobs: dict[str, Callable[[], Awaitable[Any]]] = {}
+        self._workers: list[asyncio.Task] = []
+        # Webhook được gửi ở task riêng để webhook chậm/lỗi không giữ worker
+        self._deliveries: set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in [*self._workers, *self._deliveries]:
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._deliveries, return_exceptions=True)
+        self._workers = []
+        self._deliveries.clear()
+
+    def submit(
+        self,
+        job: Callable[[], Awaitable[Any]],
+        owner: str,
+        webhook_url: Optional[str] = None,
+    ) -> str:
+        """Queues a job and returns its task id; raises TaskQueueFullError when the queue is full."""
+        self._purge()
+        task_id = str(uuid.uuid4())
+        record = {
+            "task_id": task_id,
+            "owner": owner,
+            "status": "queued",
+            "result": None,
+            "error": None,
+            "webhook_url": webhook_url,
+            "created_at": time.time(),
+            "finished_at": None,
+        }
+        try:
+            self._queue.put_nowait(task_id)
+        except asyncio.QueueFull:
+            raise TaskQueueFullError("Task queue is full")
+        self._tasks[task_id] = record
+        self._jobs[task_id] = job
+        return task_id
+
+    def get(self, task_id: str) -> Optional[dict[str, Any]]:
+        self._purge()
+        return self._tasks.get(task_id)
+
+    def _purge(self) -> None:
+        now = time.time()
+        expired = [
+            task_id
+            for task_id, record in self._tasks.items()
+            if record["finished_at"] and now - record["finished_at"] > self.result_ttl
+        ]
+        for task_id in expired:
+            del self._tasks[task_id]
+
+    async def _worker(self) -> None:
+        while True:
+            task_id = await self._queue.get()
+            record = self._tasks.get(task_id)
+            job = self._jobs.pop(task_id, None)
+            try:
+                if record is None or job is None:
+                    continue
+                record["status"] = "running"
+                try:
+                    record["result"] = await job()
+                    record["status"] = "completed"
+                except Exception as e:
+                    print(f"Background task {task_id} failed: {e}")
+                    record["status"] = "failed"
+                    record["error"] = str(e)
+                record["finished_at"] = time.time()
+                if record["webhook_url"]:
+                    delivery = asyncio.create_task(self._notify(record))
+                    self._deliveries.add(delivery)
+                    delivery.add_done_callback(self._deliveries.discard)
+            finally:
+                self._queue.task_done()
+
+    async def _notify(self, record: dict[str, Any]) -> None:
+        payload = {key: record[key] for key in ("task_id", "status", "result", "error")}
+        # Kiểm tra lại lúc gửi: DNS có thể đã đổi sang địa chỉ nội bộ sau khi submit
+        if not await webhook_allowed(record["webhook_url"]):
+            print(f"Webhook for task {record['task_id']} rejected: {record['webhook_url']}")
+            return
+        for attempt in range(WEBHOOK_RETRIES):
+            try:
+                response = await get_http_client().post(
+                    record["webhook_url"], json=payload, timeout=build_timeout(read=WEBHOOK_TIMEOUT)
+                )
+                if response.status_code < 500:
+                    return
+            except Exception as e:
+                print(f"Webhook for task {record['task_id']} failed (attempt {attempt + 1}): {e}")
+            await asyncio.sleep(2 ** attempt)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "workers": len(self._workers),
+            "tracked": len(self._tasks),
+            "webhooks_in_flight": len(self._deliveries),
+        }
+
+
+task_manager = TaskManager()
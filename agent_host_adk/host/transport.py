@@ -0,0 +1,78 @@
+import asyncio
+import os
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Cấu hình transport HTTP dùng chung cho host -> agent (card resolution + gửi message)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "50"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "50"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "300"))
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", "30"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "30"))
+HTTP2 = os.getenv("HTTP2", "false").lower() == "true"
+
+_client: Optional[httpx.AsyncClient] = None
+_host_limits: dict[str, asyncio.Semaphore] = {}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def build_timeout(read: Optional[float] = None) -> httpx.Timeout:
+    """Builds a timeout with separate connect/read/write/pool values."""
+    return httpx.Timeout(
+        connect=HTTP_CONNECT_TIMEOUT,
+        read=HTTP_READ_TIMEOUT if read is None else read,
+        write=HTTP_WRITE_TIMEOUT,
+        pool=HTTP_POOL_TIMEOUT,
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the shared, pooled async HTTP client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        http2 = HTTP2
+        if http2 and not _http2_available():
+            print("WARNING: HTTP2=true but the 'h2' package is not installed, falling back to HTTP/1.1")
+            http2 = False
+        _client = httpx.AsyncClient(
+            timeout=build_timeout(),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            http2=http2,
+        )
+    return _client
+
+
+def host_limiter(url: str) -> asyncio.Semaphore:
+    """Returns the semaphore capping concurrent requests to the host of `url`."""
+    parts = urlsplit(url)
+    key = f"{parts.scheme}://{parts.netloc}"
+    if key not in _host_limits:
+        _host_limits[key] = asyncio.Semaphore(HTTP_MAX_PER_HOST)
+    return _host_limits[key]
+
+
+async def close_http_client() -> None:
+    """Closes the shared async HTTP client."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
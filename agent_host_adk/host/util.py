@@ -5,15 +5,14 @@ from google.adk.events import Event
 from datetime import datetime
 import tempfile, os, mimetypes
 from a2a.types import  FilePart
-import base64
-import uuid
 import json
 from dotenv import load_dotenv
 load_dotenv()
 import os
-import jwt
-IMAGE_URL = os.getenv("IMAGE_URL","http://localhost:9000/image/")
-secret_key = os.getenv("SECRET_KEY","")
+from .auth import Claims
+from .scheduler import llm_leases
+from .singleflight import SingleFlight
+agent_flight = SingleFlight()
 # ANSI color codes for terminal output
 class Colors:
     RESET = "\033[0m"
@@ -63,23 +62,6 @@ async def display_state(
     except Exception as e:
         print(f"Error displaying state: {e}")
 
-async def store_file_temporarily(list_file:list[dict[str:str]] ) -> str:
-    """Store a File from base 64 to ."""
-    try:
-        image_urls = []
-        for file in list_file: 
-            # Decode về bytes get("file").get("bytes")
-            image_bytes = base64.b64decode(file.get("file").get("bytes"))
-            id = uuid.uuid4()
-            # Lưu thành file PNG
-            with open(f"host/imgs/baocao_{id}.png", "wb") as f:
-                f.write(image_bytes)
-            image_urls.append(IMAGE_URL + f"baocao_{id}.png")
-        return image_urls
-    except Exception as e:
-        print(f"Error storing file temporarily: {e}")
-        return None
-
 async def process_agent_response(event: Event):
     """Process and display agent response events."""
     # Check for specific parts first
@@ -173,7 +155,19 @@ async def process_agent_response(event: Event):
 
 
 
-async def call_agent_async(runner: Runner, user_id:str, session_id:str, query: str,token:str):
+async def call_agent_async(runner: Runner, claims: Claims, session_id:str, query: str):
+    """Call the agent asynchronously with the user's query.
+
+    Identical in-flight calls (same user, session and query, e.g. a double submit)
+    share a single agent run instead of appending the turn to the session twice.
+    """
+    return await agent_flight.do(
+        (claims.sub, session_id, query),
+        lambda: _run_agent_async(runner, claims, session_id, query),
+    )
+
+
+async def _run_agent_async(runner: Runner, claims: Claims, session_id:str, query: str):
     
     """Call the agent asynchronously with the user's query."""
     content = types.Content(role="user", parts=[types.Part(text=query)])
@@ -182,29 +176,26 @@ async def call_agent_async(runner: Runner, user_id:str, session_id:str, query: s
     )
     final_response_text = None
     state_delta: dict[str, str] = {
-    "token": token,
+    "token": claims.token,
 }
     try:
-        async for event in runner.run_async(
-            user_id=user_id, session_id=session_id, new_message=content,state_delta=state_delta
-        ):
-            # Process each event and get the final response if available
-            response = await process_agent_response(event)
-            final_response_text = response
+        # Trả các slot LLM còn giữ nếu model lỗi hoặc lượt chạy bị huỷ
+        with llm_leases.run_scope():
+            async for event in runner.run_async(
+                user_id=claims.sub, session_id=session_id, new_message=content,state_delta=state_delta
+            ):
+                # Process each event and get the final response if available
+                response = await process_agent_response(event)
+                final_response_text = response
     except Exception as e:
         print(f"Error during agent call: {e}")
+    finally:
+        await flush_session(runner, claims.sub, session_id)
     print("Agent call completed.")
     return final_response_text
 
-def check_token(token: str) -> str|None:
-    """Check if the provided token is valid."""
-    
-    # Implement your token validation logic here
-    # For example, check against a database or an external service
-    try:
-        decoded = jwt.decode(token, secret_key, algorithms=["HS256"])
-        return None
-    except jwt.ExpiredSignatureError as e:
-        return f"Token đã hết hạn: {e}"
-    except jwt.InvalidTokenError as e:
-        return "Token không hợp lệ"
+async def flush_session(runner: Runner, user_id: str, session_id: str) -> None:
+    """Writes the events a write-coalescing session service still buffers for this session."""
+    flush = getattr(runner.session_service, "flush", None)
+    if flush is not None:
+        await flush(runner.app_name, user_id, session_id)